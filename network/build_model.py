@@ -13,10 +13,10 @@
 #--------------------------------------
 # from __future__ import print_function
 
-#import os
+import os
 import networkx as nx
 
-from network.patient_service import patient
+from network.patient_service import patient, EDGE as PATIENT_EDGE
 from network.ontology_service import ontology
 from network.graphical_db_service import graphical_db
 
@@ -34,20 +34,35 @@ class build_model(object):
         self.manP  = Graph()
         self.manO  = Graph()
         self.manPO = Graph()
+        self.removedP    = []
+        self.removedPids = []
+        self.incremental = False
         self.ontology_obo_name = ['hp', 'go', 'doid', 'asdpto', 'adar']
         self.ontology_ID       = ['HP', 'GO', 'DOID', 'ASDPTO', 'ADAR']
         self.ontology_rels     = ['subClassOf']
 
     # This (and patient_service) will change, but for moment
     # load our patient network
-    def patient_network(self):
+    # incremental: name of the patient index file kept between runs, so only
+    # patients added or changed since then are scored (see patientHPsim_incremental);
+    # manP then only holds the new or changed edges, the edges to delete are
+    # kept in removedP, and the ids of the patients to delete in removedPids
+    def patient_network(self, workers=1, incremental=None):
         self.manP = Graph()
+        self.removedP    = []
+        self.removedPids = []
+        self.incremental = incremental is not None
         pn = patient()
         pn.load_data()
-        pn.get_nodes()
-        pn.patientHPsim()
-        pn.patientHPsim_edges()
-        pn.get_edges()
+        pn.get_nodes_bulk()
+        if incremental is not None:
+            pn.patientHPsim_incremental(fname=incremental)
+            self.removedP    = pn.ss_removed
+            self.removedPids = pn.ids_removed
+        else:
+            pn.patientHPsim(workers=workers)
+            pn.patientHPsim_edges()
+        pn.get_edges_bulk()
         self.manP.graph=pn.gg.copy()
 
     def ontology_network(self, handle=None, rels=None):
@@ -79,25 +94,42 @@ class build_model(object):
         self.manPO.graph = self.manP.link_networks(internal_key=key, external_graph=self.manO.graph.copy(), rel_template=rel.att_map)
 
 
-    def import_networks(self):
+    def import_networks(self, sync=None):
+
+        # with sync (a directory for the load states), only push what changed
+        # since the previous import (see graphical_db.sync). An incremental
+        # patient network only holds its changed edges, which sync would take
+        # for the full edge set, deleting all the others.
+        if sync is not None and self.incremental:
+            raise ValueError("an incremental patient network can not be synced, load it without sync")
+
+        def load(graph, name, edgesOnly=False, removed=(), removedIds=()):
+            # the three loads share one pooled driver (see network.utils.drivers)
+            with graphical_db(graph=graph.copy()) as gdb:
+                if sync is None:
+                    gdb.save_with_unwind(edgesOnly=edgesOnly)
+                    if removed:
+                        gdb.delete_edges(removed, PATIENT_EDGE, 'Patient', 'Patient', directed=False)
+                    if removedIds:
+                        gdb.delete_nodes(removedIds, 'Patient')
+                else:
+                    os.makedirs(sync, exist_ok=True)
+                    gdb.sync(os.path.join(sync, "{}.json".format(name)), edgesOnly=edgesOnly)
 
         print("import Patient Network...\n")
 
-        gdb = graphical_db(graph=self.manP.graph.copy())
-        gdb.save_with_unwind()
+        load(self.manP.graph, 'patient', removed=self.removedP, removedIds=self.removedPids)
 
         print("... done.\n")
 
         print("import HP Ontology Network...\n")
 
-        gdb = graphical_db(graph=self.manO.graph.copy())
-        gdb.save_with_unwind()
+        load(self.manO.graph, 'ontology')
 
         print("... done.\n")
 
         print("import edges between Patient and HP Ontology Networks...\n")
 
-        gdb = graphical_db(graph=self.manPO.graph.copy())
-        gdb.save_with_unwind(edgesOnly=True)
+        load(self.manPO.graph, 'patient_ontology', edgesOnly=True)
 
         print("... done.\n")
\ No newline at end of file
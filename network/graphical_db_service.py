@@ -1,23 +1,38 @@
 import pandas as pd
-import logging, yaml, json
-import itertools, uuid, click
-import pkg_resources
+import logging, json
+import itertools, uuid, click, asyncio
+import os, gzip
 
 from network.model.graph_manager import Graph
 from network.model.graph_query   import Query, QueryLocation, QueryType
+from network.model.schema_manager import SchemaManager
+from network.utils import batching, admin_import, sync_state, utils, drivers, checkpoint, metrics
+from network.utils.options import LoadOptions
 
 from typing import Union, Dict, List
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
-from neo4j.v1 import GraphDatabase as bolt_gdb
 from neo4j.v1.types import Node, Record
 
-# Nice to have, but we may want to remove this later, as/if only using bolt??
-from neo4jrestclient.client import GraphDatabase as http_gdb
-
 neo4j_log = logging.getLogger("neo4j.bolt")
 neo4j_log.setLevel(logging.WARNING)
 
+# concurrent sessions for the parallel writers
+CONCURRENCY = 4
+
+# server update counters summed into the load statistics
+COUNTERS = ['nodes_created', 'relationships_created', 'properties_set', 'labels_added']
+
+# edge attributes that identify the edge (and its end labels), not set as properties
+EDGE_KEYS = ['subject', 'predicate', 'object', 'subject_label', 'object_label']
+
+# planner operators that mean an edge MATCH is not using a unique-id index
+SCANS = ['AllNodesScan', 'NodeByLabelScan']
+
+# prepared batches buffered per consumer by the pipelined loader
+QUEUE_DEPTH = 2
+
 # For the moment, lets see if we can import networkx graphs into neo4j (<- YES WE CAN:
 #  Tested .save() and .save_with_unwind() with the Patient network.),
 # using kgx's batch queries... the kgx package also has the functionality
@@ -33,45 +48,71 @@ class graphical_db(Graph):
 
     Does not load from config file if uri and username are provided.
 
+    Loader behaviour (batch sizes, transactions) is set by `options`, a
+    network.utils.options.LoadOptions.
+
+    Bolt drivers are shared by all instances with the same URI and
+    credentials; close() (or using the instance as a context manager)
+    releases it.
+
     """
 
-    def __init__(self, graph=None, host=None, ports=None, username=None, password=None, **args):
+    def __init__(self, graph=None, host=None, ports=None, username=None, password=None, options=None, **args):
         super(graphical_db, self).__init__(graph)
 
         self.bolt_driver = None
         self.http_driver = None
+        self.options     = options if options is not None else LoadOptions()
+        self.checkpoint  = None
+        self.metrics     = metrics.LoadMetrics()
+        self.schema      = None
 
+        # drivers are shared per URI and credentials (see network.utils.drivers);
+        # args are bolt driver settings, e.g. max_connection_pool_size
         if ports is None:
             # read from config
-            with open(pkg_resources.resource_filename('network', 'config.yml'), 'r') as ymlfile:
-                #with open('config.yml', 'r') as ymlfile:
-                cfg = yaml.load(ymlfile)
-                bolt_uri = "bolt://{}:{}".format(cfg['neo4j']['host'], cfg['neo4j']['ports']['bolt'])
-                username = cfg['neo4j']['username']
-                password = cfg['neo4j']['password']
-                logging.debug("Initializing bolt driver with URI: {}".format(bolt_uri))
-                self.bolt_driver = bolt_gdb.driver(bolt_uri, auth=(username, password), **args)
-
-                if 'http_port' in cfg['neo4j']:
-                    http_uri = "http://{}:{}".format(cfg['neo4j']['host'], cfg['neo4j']['ports']['http'])
-                    logging.debug("Initializing http driver with URI: {}".format(http_uri))
-                    self.http_driver = http_gdb(http_uri, username=username, password=password)
-                if 'https_port' in cfg['neo4j']:
-                    https_uri = "https://{}:{}".format(cfg['neo4j']['host'], cfg['neo4j']['ports']['https'])
-                    logging.debug("Initializing https driver with URI: {}".format(https_uri))
-                    self.http_driver = http_gdb(https_uri, username=username, password=password)
+            cfg = drivers.load_config()
+            bolt_uri = "bolt://{}:{}".format(cfg['neo4j']['host'], cfg['neo4j']['ports']['bolt'])
+            username = cfg['neo4j']['username']
+            password = cfg['neo4j']['password']
+            settings = drivers.pool_settings(cfg)
+            settings.update(args)
+            self.bolt_driver = drivers.bolt_driver(bolt_uri, username, password, **settings)
+
+            if 'http_port' in cfg['neo4j']:
+                http_uri = "http://{}:{}".format(cfg['neo4j']['host'], cfg['neo4j']['ports']['http'])
+                self.http_driver = drivers.http_driver(http_uri, username, password)
+            if 'https_port' in cfg['neo4j']:
+                https_uri = "https://{}:{}".format(cfg['neo4j']['host'], cfg['neo4j']['ports']['https'])
+                self.http_driver = drivers.http_driver(https_uri, username, password)
         else:
             if 'bolt' in ports:
                 bolt_uri = "bolt://{}:{}".format(host, ports['bolt'])
-                self.bolt_driver = bolt_gdb.driver(bolt_uri, auth=(username, password), **args)
+                self.bolt_driver = drivers.bolt_driver(bolt_uri, username, password, **args)
             if 'http' in ports:
                 http_uri = "http://{}:{}".format(host, ports['http'])
-                self.http_driver = http_gdb(http_uri, username=username, password=password)
+                self.http_driver = drivers.http_driver(http_uri, username, password)
             if 'https' in ports:
                 https_uri = "https://{}:{}".format(host, ports['https'])
-                self.http_driver = http_gdb(https_uri, username=username, password=password)
+                self.http_driver = drivers.http_driver(https_uri, username, password)
+
+    def close(self, close_driver=False):
+        """
+        Release the bolt driver back to the shared registry; with
+        close_driver, also close its connections if no one else uses it
+        """
+
+        if self.bolt_driver is not None:
+            drivers.release(self.bolt_driver, close=close_driver)
+        self.bolt_driver = None
+        self.http_driver = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
- 
     def build_label(self, label:Union[List[str], str, None]) -> str:
         """
         Takes a potential label and turns it into the string representation
@@ -156,48 +197,292 @@ class graphical_db(Graph):
         query = "MERGE (n:{label} {{id: $id}}) SET {properties}".format(label=label, properties=properties)
         tx.run(query, **obj)
 
-    def save_node_unwind(self, nodes_by_category, property_names):
+    def run_batch(self, session, query, group=None, **params):
+        """
+        Run one UNWIND batch, as an auto-commit query or, with
+        options.explicit_tx, inside an explicit write transaction,
+        returning the result summary. Transient errors are retried with
+        exponential backoff (options.retries, backoff, max_backoff), and
+        counted in the metrics of `group`.
+        """
+
+        def run():
+            if self.options.explicit_tx:
+                with session.begin_transaction() as tx:
+                    summary = tx.run(query, **params).consume()
+                    tx.commit()
+                return summary
+
+            return session.run(query, **params).consume()
+
+        def on_retry(error):
+            if group is not None:
+                self.metrics.retry(group)
+
+        return checkpoint.retry(run, self.options.retries, self.options.backoff, self.options.max_backoff,
+                                on_retry=on_retry)
+
+    def write_batches(self, session, query, rows, name, param, group=None, part=None, **params):
+        """
+        Write rows in UNWIND batches over one session, passing each slice as
+        the `param` query parameter. Batches are options.batch_size rows, or
+        sized by a batching.BatchSizer with options.adaptive.
+
+        Batches are recorded in the metrics of `group` (e.g. 'nodes:HPO',
+        default `name`). During a checkpointed load, committed batches are
+        recorded under `group` (and `part`, for a partition of the group), and
+        rows already committed by a previous run over the same rows are skipped.
+
+        Returns the load statistics: batches, rows, ms and the COUNTERS
+        """
+
+        sizer = None
+        if self.options.adaptive:
+            sizer = batching.BatchSizer(self.options.batch_size, self.options.min_batch_size,
+                                        self.options.max_batch_size, self.options.target_ms,
+                                        self.options.max_payload_bytes)
+
+        stats = dict.fromkeys(['batches', 'rows', 'ms'] + COUNTERS, 0)
+
+        metric = group if group is not None else name
+        key    = group if part is None or group is None else '{}:{}'.format(group, part)
+
+        if self.checkpoint is not None and key is not None:
+            self.checkpoint.check(key, len(rows), checkpoint.fingerprint(rows))
+
+        i = 0
+        while i < len(rows):
+            if self.checkpoint is not None and key is not None:
+                i = self.checkpoint.resume(key, i)
+                if i >= len(rows):
+                    break
+
+            size   = sizer.size if sizer is not None else self.options.batch_size
+            subset = rows[i:i + size]
+            logging.info("{} subset: {}-{}".format(name, i, i + len(subset)))
+
+            params[param] = subset
+            time_start = self.current_time_in_millis()
+            summary = self.run_batch(session, query, group=metric, **params)
+            time_end = self.current_time_in_millis()
+            logging.debug("time taken to load {}: {} ms".format(name, time_end - time_start))
+
+            payload = batching.payload_bytes(subset)
+            self.metrics.record(metric, len(subset), time_end - time_start, payload, summary)
+
+            if self.checkpoint is not None and key is not None:
+                self.checkpoint.commit(key, i, i + len(subset))
+
+            stats['batches'] += 1
+            stats['rows']    += len(subset)
+            stats['ms']      += time_end - time_start
+            for c in COUNTERS:
+                stats[c] += getattr(summary.counters, c, 0) if summary is not None else 0
+
+            if sizer is not None:
+                sizer.update(len(subset), time_end - time_start, payload)
+
+            i += len(subset)
+
+        return stats
+
+    def export_metrics(self, fname=None, format='json'):
+        """
+        Load metrics (see network.utils.metrics) per node category and edge
+        group, as JSON or Prometheus text ('prometheus'), written to fname if given
+        """
+
+        text = self.metrics.to_prometheus() if format == 'prometheus' else self.metrics.to_json()
+
+        if fname is not None:
+            with open(fname, 'w') as fh:
+                fh.write(text)
+
+        return text
+
+    @staticmethod
+    def add_stats(total, stats):
+        """
+        Sum load statistics (see write_batches) into total
+        """
+
+        for k, v in stats.items():
+            total[k] = total.get(k, 0) + v
+        return total
+
+    def explain(self, session, query, **params):
+        """
+        Planner operators of a query (EXPLAIN, so nothing is run), root first
+        """
+
+        plan = session.run("EXPLAIN " + query, **params).consume().plan
+
+        operators = []
+        stack = [plan] if plan is not None else []
+        while stack:
+            op = stack.pop()
+            operators.append(op.operator_type)
+            stack.extend(reversed(op.children))
+
+        return operators
+
+    def report_edge_group(self, key, operators, stats):
+        """
+        Log the plan and load statistics of an edge group (predicate, subject label, object label)
+        """
+
+        logging.info("edges plan {}: {}".format(key, ' <- '.join(operators)))
+        scans = [op for op in operators if op.split('@')[0] in SCANS]
+        if scans:
+            logging.warning("edges {} are matched by label scan ({}), not by unique id index".format(key, ', '.join(scans)))
+        logging.info("edges loaded {}: {}".format(key, stats))
+
+    @staticmethod
+    def node_rows(nodes, property_names=None):
+        """
+        Properties and (lazily built) UNWIND rows of a group of nodes; the
+        properties are the group's own (see batching.schema) unless
+        property_names is given
+        """
+
+        if property_names is None:
+            property_names = batching.schema(nodes, ['category'])
+        keys = ['id'] + [k for k in property_names if k not in ('id', 'category')]
+
+        return keys, batching.Rows(nodes, keys)
+
+    @staticmethod
+    def edge_rows(edges, property_names=None):
+        """
+        Properties and (lazily built) UNWIND rows of a group of edges; the
+        properties are the group's own (see batching.schema) unless
+        property_names is given
+        """
+
+        if property_names is None:
+            property_names = batching.schema(edges, EDGE_KEYS)
+        keys = ['subject', 'object'] + [k for k in property_names if k not in EDGE_KEYS]
+
+        return keys, batching.Rows(edges, keys)
+
+    def save_node_unwind(self, nodes_by_category, property_names=None):
         """
         Save all nodes into neo4j using the UNWIND cypher clause
         """
 
-        for category in nodes_by_category.keys():
-            self.populate_missing_properties(nodes_by_category[category], property_names)
-            query = self.generate_unwind_node_query(category, property_names)
-            nodes = nodes_by_category[category]
-            for i in range(0, len(nodes), 1000):
-                end = i + 1000
-                subset = nodes[i:end]
-                logging.info("nodes subset: {}-{}".format(i, end))
-                time_start = self.current_time_in_millis()
-                with self.bolt_driver.session() as session:
-                    session.run(query, nodes=subset)
-                time_end = self.current_time_in_millis()
-                logging.debug("time taken to load nodes: {} ms".format(time_end - time_start))
+        for category, nodes in nodes_by_category.items():
+            keys, rows = self.node_rows(nodes, property_names)
+            query = self.generate_unwind_node_query(category, keys)
+            self.schema_manager().check([query])
+            with self.bolt_driver.session() as session:
+                self.write_batches(session, query, rows, 'nodes', 'nodes', group='nodes:' + category)
+
+    def save_node_unwind_parallel(self, nodes_by_category, property_names=None, concurrency=CONCURRENCY):
+        """
+        Save all nodes into neo4j using the UNWIND cypher clause, spreading
+        every category over a pool of `concurrency` sessions.
+
+        Node batches never share ids, so they can be written concurrently.
+        Each category is cut into `concurrency` contiguous partitions, each
+        written over its own session by write_batches, so batch sizing
+        (options.adaptive) and checkpoints work per partition as they do for
+        the serial load.
+        """
+
+        def worker(query, keys, nodes, group, part):
+            with self.bolt_driver.session() as session:
+                return self.write_batches(session, query, batching.Rows(nodes, keys), 'nodes', 'nodes',
+                                          group=group, part=part)
+
+        futures = []
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for category, nodes in nodes_by_category.items():
+                keys, rows = self.node_rows(nodes, property_names)
+                query = self.generate_unwind_node_query(category, keys)
+                self.schema_manager().check([query])
 
-            #with self.bolt_driver.session() as session:
-            #    session.run(query, nodes=nodes_by_category[category])
+                size = -(-len(nodes) // concurrency)
+                for p, start in enumerate(range(0, len(nodes), size)):
+                    futures.append(pool.submit(worker, query, keys, nodes[start:start + size],
+                                               'nodes:' + category, 'p{}'.format(p)))
 
-    def save_edge_unwind(self, edges_by_relationship_type, property_names):
+            for future in futures:
+                future.result()
+
+    def save_edge_unwind(self, edges_by_group, property_names=None):
         """
-        Save all edges into neo4j using the UNWIND cypher clause
+        Save all edges into neo4j using the UNWIND cypher clause, one query per
+        (predicate, subject label, object label) group, so each MATCH can use
+        the labels' unique id index.
+
+        Returns the plan operators and load statistics of each group
         """
 
-        for predicate in edges_by_relationship_type:
-            self.populate_missing_properties(edges_by_relationship_type[predicate], property_names)
-            subject_label = edges_by_relationship_type[predicate][0]['subject_label']
-            object_label  = edges_by_relationship_type[predicate][0]['object_label']
-            query = self.generate_unwind_edge_query(predicate, subject_label, object_label, property_names)
-            edges = edges_by_relationship_type[predicate]
-            for i in range(0, len(edges), 1000):
-                end = i + 1000
-                subset = edges[i:end]
-                logging.info("edges subset: {}-{}".format(i, end))
-                time_start = self.current_time_in_millis()
+        report = {}
+        for key, edges in edges_by_group.items():
+            predicate, subject_label, object_label = key
+            keys, rows = self.edge_rows(edges, property_names)
+            query = self.generate_unwind_edge_query(predicate, subject_label, object_label, keys)
+            self.schema_manager().check([query])
+            with self.bolt_driver.session() as session:
+                operators = self.explain(session, query, edges=[], relationship=predicate)
+                stats = self.write_batches(session, query, rows, 'edges', 'edges', group='edges:' + ':'.join(key),
+                                           relationship=predicate)
+            self.report_edge_group(key, operators, stats)
+            report[key] = {'plan': operators, 'stats': stats}
+
+        return report
+
+    def save_edge_unwind_parallel(self, edges_by_group, property_names=None, concurrency=CONCURRENCY,
+                                  max_rounds=batching.ROUNDS):
+        """
+        Save all edges into neo4j using the UNWIND cypher clause, over a pool
+        of `concurrency` sessions, without lock conflicts.
+
+        Each (predicate, subject label, object label) group's edges are
+        scheduled (see batching.conflict_free_rounds) into rounds of
+        partitions with non-overlapping end nodes: the partitions of a round
+        run concurrently, each in batches over its own session, and a round
+        starts once the previous one is done. Edges still conflicting after
+        max_rounds are loaded serially at the end.
+
+        Returns the plan operators and load statistics of each group
+        """
+
+        def worker(query, keys, predicate, edges, group, part):
+            with self.bolt_driver.session() as session:
+                return self.write_batches(session, query, batching.Rows(edges, keys), 'edges', 'edges',
+                                          group=group, part=part, relationship=predicate)
+
+        report = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for key, edges in edges_by_group.items():
+                predicate, subject_label, object_label = key
+                keys, rows = self.edge_rows(edges, property_names)
+                query = self.generate_unwind_edge_query(predicate, subject_label, object_label, keys)
+                self.schema_manager().check([query])
+
                 with self.bolt_driver.session() as session:
-                    session.run(query, relationship=predicate, edges=subset)
-                time_end = self.current_time_in_millis()
-                logging.debug("time taken to load edges: {} ms".format(time_end - time_start))
+                    operators = self.explain(session, query, edges=[], relationship=predicate)
+
+                stats = {}
+                rounds, leftover = batching.conflict_free_rounds(edges, concurrency, max_rounds)
+
+                for r, parts in enumerate(rounds):
+                    logging.info("edges round ({}, {}): {} groups, {} edges".format(key, r, len(parts), sum(len(g) for g in parts)))
+                    group = 'edges:' + ':'.join(key)
+                    for future in [pool.submit(worker, query, keys, predicate, part, group, 'r{}p{}'.format(r, p))
+                                   for p, part in enumerate(parts)]:
+                        self.add_stats(stats, future.result())
+
+                if leftover:
+                    logging.info("edges serialized ({}): {} edges".format(key, len(leftover)))
+                    self.add_stats(stats, worker(query, keys, predicate, leftover, 'edges:' + ':'.join(key), 'serial'))
+
+                self.report_edge_group(key, operators, stats)
+                report[key] = {'plan': operators, 'stats': stats}
+
+        return report
 
     def generate_unwind_node_query(self, label, property_names):
         """
@@ -208,13 +493,21 @@ class graphical_db(Graph):
 
         properties_dict = {p : p for p in property_names if p not in ignore_list}
 
-        properties = ', '.join('n.{0}=node.{0}'.format(k) for k in properties_dict.keys() if k != 'id')
+        properties = ''.join(', n.{0}=node.{0}'.format(k) for k in properties_dict.keys() if k != 'id')
 
-        query = """
-        UNWIND $nodes AS node
-        MERGE (n:Node {{id: node.id}})
-        SET n:{label}, {properties}
-        """.format(label=label, properties=properties)
+        # fresh loads (see LoadOptions.fresh) skip the lookup of existing nodes
+        if self.options.fresh:
+            query = """
+            UNWIND $nodes AS node
+            CREATE (n:Node {{id: node.id}})
+            SET n:{label}{properties}
+            """.format(label=label, properties=properties)
+        else:
+            query = """
+            UNWIND $nodes AS node
+            MERGE (n:Node {{id: node.id}})
+            SET n:{label}{properties}
+            """.format(label=label, properties=properties)
 
         query = self.clean_whitespace(query)
 
@@ -234,17 +527,19 @@ class graphical_db(Graph):
         if object_label is '':
             object_label = 'Node'
 
-        ignore_list = ['subject', 'predicate', 'object', 'subject_label', 'object_label']
-        properties_dict = {p : "edge.{}".format(p) for p in property_names if p not in ignore_list}
+        properties_dict = {p : "edge.{}".format(p) for p in property_names if p not in EDGE_KEYS}
 
         properties = ', '.join('r.{0}=edge.{0}'.format(k) for k in properties_dict.keys())
+        if properties:
+            properties = 'SET ' + properties
 
         query="""
         UNWIND $edges AS edge
         MATCH (s:{subject_label} {{id: edge.subject}}), (o:{object_label} {{id: edge.object}})
-        MERGE (s)-[r:{edge_label}]->(o)
-        SET {properties}
-        """.format(subject_label=subject_label, object_label=object_label, properties=properties, edge_label=relationship)
+        {write} (s)-[r:{edge_label}]->(o)
+        {properties}
+        """.format(subject_label=subject_label, object_label=object_label, properties=properties, edge_label=relationship,
+                   write='CREATE' if self.options.fresh else 'MERGE')
 
         query = self.clean_whitespace(query)
 
@@ -290,45 +585,378 @@ class graphical_db(Graph):
                 session.write_transaction(self.save_edge, row.to_dict())
         self.neo4j_report()
 
-    def save_with_unwind(self, edgesOnly=False):
+    def save_with_unwind(self, edgesOnly=False, concurrency=1):
 
         """
-        Load from a nx graph to neo4j using the UNWIND cypher clause
+        Load from a nx graph to neo4j using the UNWIND cypher clause,
+        writing nodes and edges over `concurrency` parallel sessions if > 1.
+        With options.checkpoint set, an interrupted load is resumed from its
+        first uncommitted batches when run again (batches MERGE, so replaying
+        one is safe, but not with options.fresh).
+
+        Returns the edge plans and load statistics, per (predicate, subject
+        label, object label) group (see save_edge_unwind)
         """
 
         nodes_by_category = {}
-        node_properties = []
         for n in self.graph.nodes():
             node = self.graph.node[n]
             if 'id' not in node:
                 continue
 
-            category = node['category']
+            # group by the normalised label set, so list valued categories work
+            category = utils.label_key(node.get('category'))
             if category not in nodes_by_category:
                 nodes_by_category[category] = [node]
             else:
                 nodes_by_category[category].append(node)
 
-            node_properties += [x for x in node if x not in node_properties]
-
-        edges_by_relationship_type = {}
-        edge_properties = []
+        # group edges by (predicate, subject label, object label), as one
+        # predicate can link several label pairs
+        edges_by_group = {}
         for e, (eso, esi, eattr) in enumerate(self.graph.edges(data=True)):
-            predicate = eattr['predicate']
-            if predicate not in edges_by_relationship_type:
-                edges_by_relationship_type[predicate] = [eattr]
+            key = self.edge_group(eattr)
+            if key not in edges_by_group:
+                edges_by_group[key] = [eattr]
             else:
-                edges_by_relationship_type[predicate].append(eattr)
-            edge_properties += [x for x in eattr.keys() if x not in edge_properties]
+                edges_by_group[key].append(eattr)
 
-        with self.bolt_driver.session() as session:
-            session.write_transaction(self.create_constraints, nodes_by_category.keys())
+        if self.options.fresh:
+            for category in nodes_by_category:
+                nodes_by_category[category] = self.dedupe(nodes_by_category[category], 'nodes', ('id',))
+            for key in edges_by_group:
+                edges_by_group[key] = self.dedupe(edges_by_group[key], 'edges', ('subject', 'predicate', 'object'))
+
+        self.ensure_schema(nodes_by_category.keys())
 
+        # with options.checkpoint, record committed batches, resuming after
+        # those of an interrupted run, and drop the checkpoint once done
+        if self.options.checkpoint is not None:
+            self.checkpoint = checkpoint.Checkpoint(self.options.checkpoint)
+
+        try:
+            if not edgesOnly:
+                if concurrency > 1:
+                    self.save_node_unwind_parallel(nodes_by_category, concurrency=concurrency)
+                else:
+                    self.save_node_unwind(nodes_by_category)
+
+            if concurrency > 1:
+                report = self.save_edge_unwind_parallel(edges_by_group, concurrency=concurrency)
+            else:
+                report = self.save_edge_unwind(edges_by_group)
+
+            if self.checkpoint is not None:
+                self.checkpoint.clear()
+        finally:
+            self.checkpoint = None
+
+        return report
+
+    @staticmethod
+    def edge_group(edge):
+        """
+        Load group of an edge: (predicate, subject label, object label)
+        """
+
+        return (edge['predicate'], edge.get('subject_label') or 'Node', edge.get('object_label') or 'Node')
+
+    @staticmethod
+    def dedupe(objs, name, keys):
+        """
+        Drop repeated nodes/edges (same values of keys), keeping the first:
+        MERGE collapses these, CREATE would duplicate them
+        """
+
+        seen, unique = set(), []
+        for obj in objs:
+            key = tuple(obj.get(k) for k in keys)
+            if key not in seen:
+                seen.add(key)
+                unique.append(obj)
+
+        if len(unique) < len(objs):
+            logging.warning("dropped {} duplicate {}".format(len(objs) - len(unique), name))
+
+        return unique
+
+    def schema_manager(self):
+        """
+        SchemaManager of the bolt driver (reading the server's schema once)
+        """
+
+        if self.schema is None or self.schema.driver is not self.bolt_driver:
+            self.schema = SchemaManager(self.bolt_driver)
+        return self.schema
+
+    def ensure_schema(self, labels):
+        """
+        Create the missing unique id constraints for labels and the :Node(id)
+        index, and wait for them to be online (see SchemaManager.ensure)
+        """
+
+        return self.schema_manager().ensure(labels)
+
+    def save_with_unwind_async(self, edgesOnly=False, concurrency=CONCURRENCY, edge_concurrency=1, queue_size=None):
+        """
+        Load from a nx graph to neo4j using the UNWIND cypher clause, with
+        batch preparation pipelined against the database writes (see
+        load_unwind_async)
+        """
+
+        return asyncio.run(self.load_unwind_async(edgesOnly, concurrency, edge_concurrency, queue_size))
+
+    async def load_unwind_async(self, edgesOnly=False, concurrency=CONCURRENCY, edge_concurrency=1, queue_size=None):
+        """
+        Load from a nx graph to neo4j using the UNWIND cypher clause, as an
+        asyncio pipeline.
+
+        A producer walks the graph, building each batch of parameter rows as
+        soon as a category (or predicate) has options.batch_size of them, and
+        puts it on a bounded queue; `concurrency` consumers each take batches
+        off the queue and write them over their own session, in a thread pool.
+        Preparing the next batches thus overlaps with the round trips of the
+        current ones, and once queue_size batches (default QUEUE_DEPTH per
+        consumer) are waiting the producer blocks, capping memory.
+
+        Rows hold each group's properties present on the node/edge, built
+        without modifying the graph. Edges are loaded once all nodes are, by
+        edge_concurrency consumers: concurrent edge batches can lock the same
+        nodes, so the default is a single writer. options.fresh is honoured as
+        for save_with_unwind.
+        """
+
+        # each group's properties (see batching.schema), as ordered dicts
+        node_keys, edge_keys = defaultdict(dict), defaultdict(dict)
+
+        for n in self.graph.nodes():
+            node = self.graph.node[n]
+            if 'id' not in node:
+                continue
+            node_keys[utils.label_key(node.get('category'))].update(dict.fromkeys(node))
+
+        for eso, esi, eattr in self.graph.edges(data=True):
+            edge_keys[self.edge_group(eattr)].update(dict.fromkeys(eattr))
+
+        node_keys = {c: self.node_rows([], list(k))[0] for c, k in node_keys.items()}
+        edge_keys = {g: self.edge_rows([], list(k))[0] for g, k in edge_keys.items()}
+
+        node_queries = {c: self.generate_unwind_node_query(c, k) for c, k in node_keys.items()}
+        edge_queries = {g: self.generate_unwind_edge_query(*g, property_names=k) for g, k in edge_keys.items()}
+
+        self.ensure_schema(node_keys.keys())
+        self.schema_manager().check(list(node_queries.values()) + list(edge_queries.values()))
+
+        # fresh loads CREATE, so skip repeated ids/edges here (see dedupe)
+        def nodes():
+            seen = set()
+            for n in self.graph.nodes():
+                node = self.graph.node[n]
+                if 'id' in node and node['id'] not in seen:
+                    if self.options.fresh:
+                        seen.add(node['id'])
+                    yield utils.label_key(node.get('category')), node
+
+        def edges():
+            seen = set()
+            for eso, esi, eattr in self.graph.edges(data=True):
+                key = (eattr['subject'], eattr['predicate'], eattr['object'])
+                if key not in seen:
+                    if self.options.fresh:
+                        seen.add(key)
+                    yield self.edge_group(eattr), eattr
+
+        if not edgesOnly:
+            await self.pipeline(nodes(), node_queries, node_keys, 'nodes', concurrency, queue_size)
+        await self.pipeline(edges(), edge_queries, edge_keys, 'edges', edge_concurrency, queue_size)
+
+    async def pipeline(self, objs, queries, keys, name, concurrency, queue_size=None):
+        """
+        Write (key, data) pairs in UNWIND batches, queries[key] per key with
+        rows of the keys[key] properties, with one producer and `concurrency`
+        consumers on a bounded queue
+        """
+
+        loop  = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=queue_size or QUEUE_DEPTH * concurrency)
+        batch_size = self.options.batch_size
+
+        async def produce():
+            buckets = defaultdict(list)
+            for key, obj in objs:
+                buckets[key].append({p: obj[p] for p in keys[key] if p in obj})
+                if len(buckets[key]) == batch_size:
+                    await queue.put((key, buckets.pop(key)))
+            for key, rows in buckets.items():
+                await queue.put((key, rows))
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        async def consume(pool, session):
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                key, rows = item
+                params = {name: rows}
+                if name == 'edges':
+                    params['relationship'] = key[0]
+                group = '{}:{}'.format(name, key if isinstance(key, str) else ':'.join(key))
+                logging.info("{} batch ({}): {}".format(name, key, len(rows)))
+                time_start = self.current_time_in_millis()
+                summary = await loop.run_in_executor(pool, lambda: self.run_batch(session, queries[key], group=group, **params))
+                time_end = self.current_time_in_millis()
+                logging.debug("time taken to load {}: {} ms".format(name, time_end - time_start))
+                self.metrics.record(group, len(rows), time_end - time_start, batching.payload_bytes(rows), summary)
+
+        sessions = [self.bolt_driver.session() for _ in range(concurrency)]
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                await asyncio.gather(produce(), *[consume(pool, s) for s in sessions])
+        finally:
+            for session in sessions:
+                session.close()
+
+    def sync(self, state_file, edgesOnly=False):
+        """
+        Differential load: push only what changed since the previous load.
+
+        A content hash per node id and per edge (subject, predicate, object)
+        is kept in state_file (see network.utils.sync_state). The current nx
+        graph's state is diffed against it, and only the created/updated
+        nodes and edges are written, and the deleted ones removed: updated
+        entries have their properties replaced (SET n = ...), so dropped
+        properties go too, and a node whose category changed is relabelled
+        in place, keeping its edges. The state file is rewritten once the
+        load is done.
+
+        Returns the diff counts, e.g. {'nodes': {'created': 3, 'updated': 1, 'deleted': 0}, 'edges': {...}}
+        """
+
+        old = sync_state.load_state(state_file)
+        new = sync_state.graph_state(self.graph, edgesOnly)
         if edgesOnly:
-            self.save_edge_unwind(edges_by_relationship_type, edge_properties)
-        else:
-            self.save_node_unwind(nodes_by_category, node_properties)
-            self.save_edge_unwind(edges_by_relationship_type, edge_properties)
+            new['nodes'] = old['nodes']
+
+        ncreated, nupdated, ndeleted = sync_state.diff(old['nodes'], new['nodes'])
+        ecreated, eupdated, edeleted = sync_state.diff(old['edges'], new['edges'])
+
+        report = {'nodes': {'created': len(ncreated), 'updated': len(nupdated), 'deleted': len(ndeleted)},
+                  'edges': {'created': len(ecreated), 'updated': len(eupdated), 'deleted': len(edeleted)}}
+        logging.info("sync diff: {}".format(report))
+
+        nodes = {}
+        for n in self.graph.nodes():
+            node = self.graph.node[n]
+            if 'id' in node:
+                nodes[node['id']] = node
+
+        edges = {}
+        for eso, esi, eattr in self.graph.edges(data=True):
+            edges[sync_state.edge_key(eattr)] = eattr
+
+        with self.bolt_driver.session() as session:
+            # removals first, then (re)writes, nodes before the edges that need them
+            for (predicate, subject_label, object_label), keys in self.group_edge_keys(edeleted, old['edges']).items():
+                self.delete_edges([(k[0], k[2]) for k in keys], predicate, subject_label, object_label, session=session)
+
+            for category, ids in self.group_node_ids(ndeleted, old['nodes']).items():
+                self.delete_nodes(ids, category, session=session)
+
+            if ncreated or nupdated:
+                self.ensure_schema(set(new['nodes'][k][0] for k in ncreated + nupdated))
+
+            # relabelled nodes are updated in place, dropping the labels they lost
+            relabel = defaultdict(list)
+            for i in ncreated + nupdated:
+                previous = old['nodes'][i][0] if i in old['nodes'] else new['nodes'][i][0]
+                relabel[(new['nodes'][i][0], previous)].append(i)
+
+            for (category, previous), ids in relabel.items():
+                dropped = [l for l in previous.split(':') if l not in category.split(':') and l != 'Node']
+                query = "UNWIND $nodes AS node MERGE (n:Node {{id: node.id}}) {remove}SET n = node, n:{label}".format(
+                    label=category, remove='REMOVE n:{} '.format(':'.join(dropped)) if dropped else '')
+                rows = [{k: v for k, v in nodes[i].items() if k != 'category'} for i in ids]
+                self.write_batches(session, query, rows, 'nodes', 'nodes', group='nodes:' + category)
+
+            for (predicate, subject_label, object_label), keys in self.group_edge_keys(ecreated + eupdated, new['edges']).items():
+                query = """
+                UNWIND $edges AS edge
+                MATCH (s:{subject_label} {{id: edge.subject}}), (o:{object_label} {{id: edge.object}})
+                MERGE (s)-[r:{edge_label}]->(o)
+                SET r = edge.properties
+                """.format(subject_label=subject_label, object_label=object_label, edge_label=predicate)
+                rows = [{'subject': k[0], 'object': k[2],
+                         'properties': {p: v for p, v in edges[k].items() if p not in sync_state.EDGE_KEYS}} for k in keys]
+                self.write_batches(session, self.clean_whitespace(query), rows, 'edges', 'edges',
+                                   group='edges:{}:{}:{}'.format(predicate, subject_label, object_label))
+
+        sync_state.save_state(state_file, new)
+
+        return report
+
+    def delete_edges(self, pairs, predicate, subject_label='Node', object_label='Node', directed=True, session=None):
+        """
+        Delete the `predicate` edges between (subject id, object id) pairs,
+        in either direction unless directed, e.g. for the patient similarity
+        edges dropped by an incremental update
+
+        Returns the load statistics (see write_batches)
+        """
+
+        if session is None:
+            with self.bolt_driver.session() as session:
+                return self.delete_edges(pairs, predicate, subject_label, object_label, directed, session)
+
+        query = """
+        UNWIND $edges AS edge
+        MATCH (s:{subject_label} {{id: edge.subject}})-[r:{edge_label}]-{arrow}(o:{object_label} {{id: edge.object}})
+        DELETE r
+        """.format(subject_label=subject_label, object_label=object_label, edge_label=predicate,
+                   arrow='>' if directed else '')
+        rows  = [{'subject': s, 'object': o} for s, o in pairs]
+        group = 'deleted_edges:{}:{}:{}'.format(predicate, subject_label, object_label)
+
+        return self.write_batches(session, self.clean_whitespace(query), rows, 'deleted edges', 'edges', group=group)
+
+    def delete_nodes(self, ids, label='Node', session=None):
+        """
+        Delete the `label` nodes with the given ids, and their edges, e.g. for
+        the patients dropped by an incremental update
+
+        Returns the load statistics (see write_batches)
+        """
+
+        if session is None:
+            with self.bolt_driver.session() as session:
+                return self.delete_nodes(ids, label, session)
+
+        query = "UNWIND $ids AS id MATCH (n:{label} {{id: id}}) DETACH DELETE n".format(label=label)
+
+        return self.write_batches(session, query, list(ids), 'deleted nodes', 'ids', group='deleted_nodes:' + label)
+
+    @staticmethod
+    def group_node_ids(ids, state):
+        """
+        Group node ids by category, from a sync state
+        """
+
+        groups = defaultdict(list)
+        for i in ids:
+            groups[state[i][0]].append(i)
+        return groups
+
+    @staticmethod
+    def group_edge_keys(keys, state):
+        """
+        Group edge keys by (predicate, subject label, object label), from a sync state
+        """
+
+        groups = defaultdict(list)
+        for k in keys:
+            subject_label, object_label = state[k][0] or 'Node', state[k][1] or 'Node'
+            groups[(k[1], subject_label, object_label)].append(k)
+        return groups
 
     def save(self):
         """
@@ -344,8 +972,9 @@ class graphical_db(Graph):
                 else:
                     labels.add(node['category'])
 
+        self.ensure_schema(labels)
+
         with self.bolt_driver.session() as session:
-            session.write_transaction(self.create_constraints, labels)
             for node_id in self.graph.nodes():
                 node_attributes = self.graph.node[node_id]
                 if 'id' not in node_attributes:
@@ -356,6 +985,76 @@ class graphical_db(Graph):
 
         self.neo4j_report()
 
+    def export_admin_csv(self, directory, delimiter=admin_import.ARRAY_DELIMITER):
+        """
+        Write the nx graph as neo4j-admin import CSV files, for a first-time
+        build of an empty database (much faster than MERGE based loading).
+
+        Nodes are written per category to nodes_<category>.csv, with an
+        id:ID column, typed property columns (lists as e.g. synonym:string[],
+        joined by the array delimiter) and :LABEL set to Node plus the
+        category's labels; edges per predicate to edges_<predicate>.csv, with
+        :START_ID, :END_ID and :TYPE. The graph is read first for the headers
+        and array delimiter, then to stream the rows straight to the files.
+
+        The array delimiter is `delimiter`, unless a list element holds it:
+        the first of admin_import.ARRAY_DELIMITERS found in none is used
+        instead, and passed to the command line.
+
+        Returns (node files, edge files, neo4j-admin import command line)
+        """
+
+        os.makedirs(directory, exist_ok=True)
+
+        def nodes():
+            for n in self.graph.nodes():
+                node = self.graph.node[n]
+                if 'id' in node:
+                    yield utils.label_key(node.get('category')), node
+
+        def edges():
+            for eso, esi, eattr in self.graph.edges(data=True):
+                yield eattr['predicate'], eattr
+
+        node_columns = admin_import.column_types(nodes(), admin_import.NODE_IGNORE + ['id'])
+        edge_columns = admin_import.column_types(edges(), admin_import.EDGE_IGNORE)
+
+        delimiters = [delimiter] + [d for d in admin_import.ARRAY_DELIMITERS if d != delimiter]
+        chosen     = admin_import.array_delimiter(itertools.chain(nodes(), edges()),
+                                                  admin_import.NODE_IGNORE + admin_import.EDGE_IGNORE, delimiters)
+        if chosen != delimiter:
+            logging.warning("array values hold '{}', using array delimiter {!r} instead".format(delimiter, chosen))
+            delimiter = chosen
+
+        node_writers = admin_import.Writers(directory, 'nodes')
+        try:
+            for category, node in nodes():
+                columns = node_columns[category]
+                writer  = node_writers.get(category, admin_import.header(columns, ['id:ID'], [':LABEL']))
+                labels  = delimiter.join(['Node'] + utils.node_labels(category))
+                writer.writerow([node['id']] +
+                                [admin_import.format_value(node.get(k), a, delimiter) for k, (t, a) in columns.items()] +
+                                [labels])
+        finally:
+            node_writers.close()
+
+        edge_writers = admin_import.Writers(directory, 'edges')
+        try:
+            for predicate, edge in edges():
+                columns = edge_columns[predicate]
+                writer  = edge_writers.get(predicate, admin_import.header(columns, [':START_ID', ':END_ID', ':TYPE']))
+                writer.writerow([edge['subject'], edge['object'], predicate] +
+                                [admin_import.format_value(edge.get(k), a, delimiter) for k, (t, a) in columns.items()])
+        finally:
+            edge_writers.close()
+
+        node_files = list(node_writers.filenames().values())
+        edge_files = list(edge_writers.filenames().values())
+        cmd = admin_import.command(node_files, edge_files, delimiter=delimiter)
+        logging.info("wrote {} node and {} edge files to {}: {}".format(len(node_files), len(edge_files), directory, cmd))
+
+        return node_files, edge_files, cmd
+
     def save_via_apoc(self, nodes_filename=None, edges_filename=None):
         """
         Load from a nx graph to neo4j, via APOC procedure
@@ -369,7 +1068,82 @@ class graphical_db(Graph):
         self._save_as_json(nodes_filename, edges_filename)
         self.save_nodes_via_apoc(nodes_filename)
         self.save_edges_via_apoc(edges_filename)
-        self.update_node_labels()
+
+    def save_via_apoc_stream(self, nodes_filename=None, edges_filename=None, batch_size=10000, parallel=True,
+                             retries=3, compress=True):
+        """
+        Load from a nx graph to neo4j via APOC procedure, streaming the graph to
+        (gzipped) JSON Lines files, one node/edge per line, and loading them
+        with apoc.periodic.iterate over bolt.
+
+        The files must be readable by the server (apoc.import.file.enabled),
+        and reading gzipped files needs an APOC with the load.json compression
+        option. The labels' id constraints are created first (see
+        ensure_schema), and edges are merged on their id. Batches of
+        batch_size run in parallel if `parallel`; edge batches locking the
+        same nodes are retried up to `retries` times.
+
+        Returns the apoc.periodic.iterate results for nodes and edges
+        """
+
+        if nodes_filename is None or edges_filename is None:
+            prefix = uuid.uuid4()
+            suffix = "jsonl.gz" if compress else "jsonl"
+            nodes_filename = "/tmp/{}_nodes.{}".format(prefix, suffix)
+            edges_filename = "/tmp/{}_edges.{}".format(prefix, suffix)
+
+        labels = self._save_as_jsonl(nodes_filename, edges_filename, compress)
+        self.ensure_schema(labels)
+
+        config = {'compression': 'GZIP'} if compress else {}
+        nodes = self.iterate_via_apoc(nodes_filename, config,
+                                      "MERGE (n:Node {id: value.id}) "
+                                      "SET n += apoc.map.removeKey(value, 'labels') "
+                                      "WITH n, value "
+                                      "CALL apoc.create.addLabels(n, value.labels) YIELD node "
+                                      "RETURN count(*) AS nodes",
+                                      batch_size, parallel, retries)
+        edges = self.iterate_via_apoc(edges_filename, config,
+                                      "MATCH (a:Node {id: value.subject}) "
+                                      "MATCH (b:Node {id: value.object}) "
+                                      "CALL apoc.merge.relationship(a, value.predicate, {id: value.id}, value, b) YIELD rel "
+                                      "RETURN count(*) AS relationships",
+                                      batch_size, parallel, retries)
+
+        return nodes, edges
+
+    def iterate_via_apoc(self, filename, config, statement, batch_size, parallel, retries):
+        """
+        Run `statement` for each `value` read from a JSON (Lines) file, with
+        apoc.periodic.iterate over bolt
+        """
+
+        logging.info("reading {} and saving to Neo4j via APOC procedure".format(filename))
+        start = self.current_time_in_millis()
+        query = """
+        CALL apoc.periodic.iterate(
+            "CALL apoc.load.json($file, null, $config) YIELD value RETURN value",
+            $statement,
+            {batchSize: $batch_size, parallel: $parallel, retries: $retries, iterateList: true,
+             params: {file: $file, config: $config}}
+        )
+        YIELD batches, total, failedBatches, errorMessages
+        RETURN batches, total, failedBatches, errorMessages
+        """
+
+        with self.bolt_driver.session() as session:
+            record = session.run(self.clean_whitespace(query), file="file://" + filename, config=config,
+                                 statement=statement, batch_size=batch_size, parallel=parallel,
+                                 retries=retries).single()
+
+        result = dict(record) if record is not None else {}
+        if result.get('failedBatches'):
+            logging.warning("APOC load of {}: {} failed batches: {}".format(filename, result['failedBatches'],
+                                                                           result['errorMessages']))
+        end = self.current_time_in_millis()
+        logging.debug("time taken for APOC procedure: {} ms".format(end - start))
+
+        return result
 
     def save_nodes_via_apoc(self, filename):
         """
@@ -380,7 +1154,10 @@ class graphical_db(Graph):
         query = """
         CALL apoc.periodic.iterate(
             "CALL apoc.load.json('file://""" + filename + """') YIELD value AS jsonValue RETURN jsonValue",
-            "MERGE (n:Node {id:jsonValue.id}) set n+=jsonValue",
+            "MERGE (n:Node {id:jsonValue.id}) SET n+=apoc.map.removeKey(jsonValue, 'labels')
+            WITH n, jsonValue
+            CALL apoc.create.addLabels(n, jsonValue.labels) YIELD node
+            RETURN count(*) as nodes",
             {
                 batchSize: 10000,
                 iterateList: true
@@ -416,33 +1193,6 @@ class graphical_db(Graph):
         end = self.current_time_in_millis()
         logging.debug("time taken for APOC procedure: {} ms".format(end - start))
 
-    def update_node_labels(self):
-        """
-        Update node labels
-        """
-        logging.info("updating node labels")
-        start = self.current_time_in_millis()
-        query_string = """
-        UNWIND $nodes as node
-        MATCH (n:Node {{id: node.id}}) SET n:{node_labels}
-        """
-
-        nodes_by_category = {}
-        for node in self.graph.nodes(data=True):
-            node_data = node[1]
-            key = ':'.join(node_data['category'])
-            if key in nodes_by_category:
-                nodes_by_category[key].append(node_data)
-            else:
-                nodes_by_category[key] = [node_data]
-
-        for category in nodes_by_category:
-            query = query_string.format(node_labels=category)
-            with self.bolt_driver.session() as session:
-                session.run(query, nodes=nodes_by_category[category])
-        end = self.current_time_in_millis()
-        logging.debug("time taken to update node labels: {} ms".format(end - start))
-
     def report(self):
         logging.info("Total number of nodes: {}".format(len(self.graph.nodes())))
         logging.info("Total number of edges: {}".format(len(self.graph.edges())))
@@ -485,31 +1235,46 @@ class graphical_db(Graph):
                     logging.info("Total {} Nodes: {}".format(label, total))
 
 
-    def create_constraints(self, tx, labels):
+    def _save_as_json(self, node_filename, edge_filename):
         """
-        Create a unique constraint on node 'id' for all labels
+        Write a graph as JSON (used internally)
         """
-        query = "CREATE CONSTRAINT ON (n:{}) ASSERT n.id IS UNIQUE"
-        label_set = set()
-
-        for label in labels:
-            if ':' in label:
-                sub_labels = label.split(':')
-                for sublabel in sub_labels:
-                    label_set.add(sublabel)
-            else:
-                label_set.add(label)
+        nodes = self._save_nodes_as_json(node_filename)
+        edges = self._save_edges_as_json(edge_filename)
 
-        for label in label_set:
-            tx.run(query.format(label))
+    @staticmethod
+    def with_labels(node):
+        """
+        Node data plus its normalised labels (used internally by the APOC
+        loaders, which set them with apoc.create.addLabels)
+        """
 
+        data = dict(node)
+        data['labels'] = utils.node_labels(node.get('category'))
+        return data
 
-    def _save_as_json(self, node_filename, edge_filename):
+    def _save_as_jsonl(self, node_filename, edge_filename, compress=True):
         """
-        Write a graph as JSON (used internally)
+        Stream a graph as JSON Lines, gzipped if compress, returning the node
+        labels written (used internally)
         """
-        nodes = self._save_nodes_as_json(node_filename)
-        edges = self._save_edges_as_json(edge_filename)
+
+        opener = gzip.open if compress else open
+        labels = set()
+
+        with opener(node_filename, "wt") as FH:
+            for n, data in self.graph.nodes(data=True):
+                data = self.with_labels(data)
+                labels.update(data['labels'])
+                FH.write(json.dumps(data, default=str))
+                FH.write("\n")
+
+        with opener(edge_filename, "wt") as FH:
+            for u, v, data in self.graph.edges(data=True):
+                FH.write(json.dumps(data, default=str))
+                FH.write("\n")
+
+        return labels
 
     def _save_nodes_as_json(self, filename):
         """
@@ -518,7 +1283,7 @@ class graphical_db(Graph):
         FH = open(filename, "w")
         nodes = []
         for node in self.graph.nodes(data=True):
-            nodes.append(node[1])
+            nodes.append(self.with_labels(node[1]))
 
         FH.write(json.dumps(nodes))
         FH.close()
@@ -529,7 +1294,7 @@ class graphical_db(Graph):
         """
         FH = open(filename, "w")
         edges = []
-        for edge in self.graph.edges_iter(data=True, keys=True):
+        for edge in self.graph.edges(data=True, keys=True):
             edges.append(edge[3])
 
         FH.write(json.dumps(edges))
@@ -549,10 +1314,3 @@ class graphical_db(Graph):
                 pair = "{}: {}".format(key, str(values))
             propertyList.append(pair)
         return ','.join(propertyList)
-
-    @staticmethod
-    def populate_missing_properties(objs, properties):
-        for obj in objs:
-            missing_properties = set(properties) - set(obj.keys())
-            for property in missing_properties:
-                obj[property] = ''
\ No newline at end of file
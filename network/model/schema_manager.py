@@ -0,0 +1,133 @@
+import logging, re
+
+# (label, property) lookups in a MATCH/MERGE pattern, e.g. (n:Node {id: node.id})
+LOOKUP = re.compile(r'\(\s*\w*\s*:\s*([\w:`]+)\s*\{\s*(\w+)\s*:')
+
+# label and property in a db.constraints()/db.indexes() description, e.g.
+# 'CONSTRAINT ON ( hpo:HPO ) ASSERT hpo.id IS UNIQUE' or 'INDEX ON :Node(id)'
+CONSTRAINT = re.compile(r'ON\s*\(\s*\w+\s*:\s*`?(\w+)`?\s*\)\s*ASSERT\s*\(?\s*\w+\.`?(\w+)`?\s*\)?\s+IS\s+UNIQUE', re.I)
+INDEX      = re.compile(r'INDEX\s+ON\s*:\s*`?(\w+)`?\s*\(\s*`?(\w+)`?\s*\)', re.I)
+
+
+class SchemaManager(object):
+    """
+    Manages the unique id constraints and indexes used by the graphical_db
+    loaders.
+
+    The existing constraints and indexes are read from the server once, and
+    only the missing ones are created, so the schema can be ensured before
+    every load. Every node is merged on :Node(id), so that is always indexed,
+    and every other label gets a unique constraint on id.
+    """
+
+    def __init__(self, driver, key='id', base_label='Node'):
+        self.driver     = driver
+        self.key        = key
+        self.base_label = base_label
+        self.unique     = None
+        self.indexed    = None
+
+    def refresh(self):
+        """
+        Read the existing unique constraints and indexes, as sets of (label, property)
+        """
+
+        self.unique, self.indexed = set(), set()
+
+        with self.driver.session() as session:
+            for record in session.run("CALL db.constraints()"):
+                m = CONSTRAINT.search(record['description'])
+                if m:
+                    self.unique.add(m.groups())
+
+            for record in session.run("CALL db.indexes()"):
+                if 'description' in record.keys():
+                    m = INDEX.search(record['description'])
+                    if m:
+                        self.indexed.add(m.groups())
+                else:
+                    # servers listing labelsOrTypes/properties instead
+                    labels, props = record['labelsOrTypes'] or [], record['properties'] or []
+                    if len(labels) == 1 and len(props) == 1:
+                        self.indexed.add((labels[0], props[0]))
+
+        # unique constraints are backed by an index
+        self.indexed |= self.unique
+
+        return self.unique, self.indexed
+
+    def ensure(self, labels, timeout=300):
+        """
+        Create the missing unique id constraints for the (':' separated)
+        labels, and the :Node(id) index, then wait up to timeout seconds for
+        them to be online. A label already having a plain index on id is
+        left as it is, as neo4j rejects a constraint over an index.
+
+        Returns the created constraints and indexes, as (label, property)
+        """
+
+        if self.unique is None:
+            self.refresh()
+
+        label_set = set()
+        for label in labels:
+            label_set.update(l for l in label.split(':') if l and l != self.base_label)
+
+        created = []
+        with self.driver.session() as session:
+            for label in sorted(label_set):
+                if (label, self.key) in self.unique:
+                    continue
+                if (label, self.key) in self.indexed:
+                    # a unique constraint can not be created over an existing index
+                    logging.info("index on :{}({}) already exists, not creating a constraint".format(label, self.key))
+                    continue
+                logging.info("creating constraint on :{}({})".format(label, self.key))
+                session.run("CREATE CONSTRAINT ON (n:{}) ASSERT n.{} IS UNIQUE".format(label, self.key)).consume()
+                self.unique.add((label, self.key))
+                self.indexed.add((label, self.key))
+                created.append((label, self.key))
+
+            if (self.base_label, self.key) not in self.indexed:
+                logging.info("creating index on :{}({})".format(self.base_label, self.key))
+                session.run("CREATE INDEX ON :{}({})".format(self.base_label, self.key)).consume()
+                self.indexed.add((self.base_label, self.key))
+                created.append((self.base_label, self.key))
+
+            if created:
+                session.run("CALL db.awaitIndexes($timeout)", timeout=timeout).consume()
+
+        return created
+
+    def unindexed(self, query):
+        """
+        The (label, property) lookups of a query with no index (or unique
+        constraint) behind them, i.e. that would run as label scans
+        """
+
+        if self.indexed is None:
+            self.refresh()
+
+        missing = []
+        for labels, prop in LOOKUP.findall(query):
+            labels = [l.strip('`') for l in labels.split(':') if l]
+            if not any((l, prop) in self.indexed for l in labels):
+                missing.append((':'.join(labels), prop))
+
+        return missing
+
+    def check(self, queries):
+        """
+        Log a warning for each query with lookups not supported by an index,
+        returning them as {query: [(label, property)]}
+        """
+
+        report = {}
+        for query in queries:
+            missing = self.unindexed(query)
+            if missing:
+                logging.warning("query without index support for {}: {}".format(
+                    ', '.join(':{}({})'.format(l, p) for l, p in missing), query))
+                report[query] = missing
+
+        return report
@@ -15,8 +15,11 @@
 
 import os
 import shutil
+import hashlib
 import pkg_resources
 import tarfile
+import numpy as np
+from scipy import sparse
 from nested_lookup import nested_lookup, get_all_keys
 from ontobio.ontol_factory import OntologyFactory
 from ontobio.slimmer import get_minimal_subgraph
@@ -28,6 +31,7 @@ from network.model.node import node
 from network.model.relationship import relationship
 
 from network.utils import utils
+from network.utils import similarity
 
 #OBOname='hp'
 #ONTpref='HP'
@@ -36,6 +40,7 @@ from network.utils import utils
 FNAME  ='local_ontologies.tar.gz'
 LOCALname = ['asdpto', 'adar']
 LOCALfile = ['ASDPhenotypeOntology_Public.json', 'autism-merged.json']
+CACHEdir  = 'cache'
 
 class ontology(object):
 
@@ -245,4 +250,41 @@ class ontology(object):
                 if k in node_dict:
                     node_dict[k] = l
 
-        return node_dict
\ No newline at end of file
+        return node_dict
+
+    def semantic_tables(self, cache=True):
+
+        # ancestor closure (terms x terms CSR, see similarity.ancestor_closure) and
+        # intrinsic information content of the loaded ontology's OBOrels/ONTpref
+        # graph, for semantic similarity. Both are cached under dataDIR/CACHEdir,
+        # keyed by the ontology name and a digest of its edges, i.e. its version.
+        gg = self.ont.get_filtered_graph(relations=self.OBOrels, prefix=self.ONTpref)
+        if self.obs is not None:
+            gg.remove_nodes_from(self.obs)
+
+        terms = sorted(str(n) for n in gg.nodes())
+        edges = sorted(set((str(u), str(v)) for u, v in gg.edges()))
+
+        digest = hashlib.sha1()
+        for t in terms:
+            digest.update(t.encode() + b'\n')
+        for u, v in edges:
+            digest.update(('%s %s\n' % (u, v)).encode())
+
+        cache_file = os.path.join(self.dataDIR, CACHEdir, '%s_%s.npz' % (self.OBOname, digest.hexdigest()[:16]))
+
+        if cache and os.path.isfile(cache_file):
+            tables  = np.load(cache_file, allow_pickle=False)
+            closure = sparse.csr_matrix((tables['data'], tables['indices'], tables['indptr']),
+                                        shape=(len(tables['terms']), len(tables['terms'])))
+            return list(tables['terms']), closure, tables['ic']
+
+        closure = similarity.ancestor_closure(terms, edges)
+        ic      = similarity.intrinsic_ic(closure)
+
+        if cache:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            np.savez(cache_file, terms=np.array(terms), ic=ic,
+                     data=closure.data, indices=closure.indices, indptr=closure.indptr)
+
+        return terms, closure, ic
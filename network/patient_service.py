@@ -8,6 +8,7 @@
 # from __future__ import print_function
 
 # --- python import statements
+import os
 import pkg_resources
 import numpy as np
 import pandas as pd
@@ -15,9 +16,25 @@ import networkx as nx
 
 from network.model import node
 from network.model import relationship
-
-FNAME = "patient_dataset.csv"
-THRES = 0.2
+from network.utils import utils
+from network.utils import similarity
+
+FNAME   = "patient_dataset.csv"
+THRES   = 0.2
+ENGINE  = "sparse"
+WORKERS = 1
+BANDS   = 32
+ROWS    = 2
+KNN     = 10
+SIMFILE = "patient_sim.dat"
+SIMCSV  = "patient_sim.csv"
+CHUNK   = 10000
+INDEX   = "patient_index.npz"
+EDGE    = "Shared_HP_terms"
+
+# patient csv column names, and those holding ';' separated term lists
+COLUMNS = {'PatientID': 'id', 'EntrezIDs': 'EntrezIDs', 'HGNCIDs': 'HGNCIDs', 'HP terms': 'HPterms', 'GO terms': 'GOterms'}
+TERMS   = ['HPterms', 'GOterms', 'EntrezIDs']
 
 # --- probably make this a more general class, to read pateient data
 class patient(object):
@@ -34,10 +51,17 @@ class patient(object):
         self.N       = 0
         self.ss      = None
         self.sim     = None
+        self.terms   = {}
+        self.vocab   = {}
+        self.method  = "HP_Jacard_Sim"
+        self.ss_removed  = []
+        self.ids_removed = []
 
     def load_data(self, fname=FNAME, fsep=','):
         self.data    = None
         self.data_CN = None
+        self.terms   = {}
+        self.vocab   = {}
         ## load patient data
         self.data = pd.read_csv("%s/%s" % (self.dataDIR, fname), sep=fsep, header='infer')
         self.data = pd.DataFrame(self.data)
@@ -46,9 +70,62 @@ class patient(object):
 
         ## load patient data column names
         # self.data.columns.str.split(',') #.str.replace(' ','_')
-        self.data.rename(columns={'PatientID': 'id', 'EntrezIDs': 'EntrezIDs', 'HGNCIDs': 'HGNCIDs', 'HP terms': 'HPterms', 'GO terms': 'GOterms'}, inplace=True)
+        self.data.rename(columns=COLUMNS, inplace=True)
+        self.data_CN = self.data.columns
+
+    def load_data_chunked(self, fname=FNAME, fsep=',', chunksize=CHUNK, terms=TERMS, csep=';'):
+
+        # streaming alternative to load_data for large exports: the csv is read
+        # chunksize rows at a time, as strings, and each chunk's term lists are
+        # encoded into integer ids (self.terms, self.vocab) as it arrives, so
+        # the full object-dtype frame is never built. self.data keeps the
+        # patient ids and the other (not encoded) columns, e.g. HGNCIDs;
+        # term_column decodes the term columns back where they are needed.
+        self.data    = None
+        self.data_CN = None
+        self.terms   = {col: [] for col in terms}
+        self.vocab   = {col: {} for col in terms}
+
+        others = [col for col in COLUMNS.values() if col not in terms]
+        dtypes = {col: str for col in COLUMNS}
+
+        data   = {col: [] for col in others}
+        reader = pd.read_csv(os.path.join(self.dataDIR, fname), sep=fsep, header='infer',
+                             usecols=list(COLUMNS), dtype=dtypes, chunksize=chunksize)
+
+        for chunk in reader:
+            chunk = chunk.fillna(value='').rename(columns=COLUMNS)
+            for col in others:
+                data[col].extend(chunk[col])
+            for col in terms:
+                rows, self.vocab[col] = similarity.encode_terms(chunk[col], vocab=self.vocab[col], sep=csep)
+                self.terms[col].extend(rows)
+
+        self.data    = pd.DataFrame(data, columns=others)
         self.data_CN = self.data.columns
 
+    def decode_terms(self, colname='HPterms', csep=';'):
+
+        # ';' joined term strings, per patient, of an encoded column
+        inverse = np.array(list(self.vocab[colname]), dtype=object)
+        return [csep.join(inverse[r]) for r in self.terms[colname]]
+
+    def term_column(self, colname='HPterms', csep=';'):
+
+        # a term column of self.data, decoded if only held encoded (load_data_chunked)
+        if colname in self.data.columns:
+            return self.data[colname]
+        return pd.Series(self.decode_terms(colname, csep), index=self.data.index)
+
+    def node_data(self):
+
+        # self.data with every encoded-only term column decoded back
+        data = self.data
+        for col in self.terms:
+            if col not in data.columns:
+                data = data.assign(**{col: self.term_column(col)})
+        return data
+
 
     def get_data(self):
         if self.data is not None:
@@ -82,7 +159,7 @@ class patient(object):
 
                 self.Nodes = []
 
-                for rk, rv in self.data.iterrows():
+                for rk, rv in self.node_data().iterrows():
                     rkeys = list(rv.keys())
                     rvals = list(rv.values)
                     att_map = {}
@@ -90,7 +167,8 @@ class patient(object):
                         att_map.setdefault(rkeys, rvals)
                         #att_map.setdefault(rkeys, []).append(rvals) #.split(';')
                     #att_map.update({'nodeID': [(rk+1)]})
-                    att_map['name']     = 'John Smith v%s' %( str(rk))
+                    # named after the patient id, not the row, so it stays put between loads
+                    att_map['name']     = 'John Smith v%s' %( str(att_map['id']))
                     att_map['label']    = 'Patient'
                     att_map['category'] = 'Patient'
                     self.gg.add_node(rk, att_map)
@@ -98,22 +176,101 @@ class patient(object):
                     # for nk, nv in att_map.items():
                     #    self.gg.node[i][nk] = nv
 
-    def patientHPsim(self):
+    def get_nodes_bulk(self):
 
+        # same nodes as get_nodes, but the attribute dicts are built from the
+        # DataFrame columns in one pass (records) and inserted with add_nodes_from
         if self.data is not None:
             self.N = len(self.data)
 
             if self.N > 0:
 
-                self.sim = np.zeros([self.N, self.N], dtype=np.double)
+                records = self.node_data().to_dict('records')
+
+                for rk, att_map in zip(self.data.index, records):
+                    att_map['name']     = 'John Smith v%s' %( str(att_map['id']))
+                    att_map['label']    = 'Patient'
+                    att_map['category'] = 'Patient'
+
+                self.gg.add_nodes_from(zip(self.data.index, records))
+
+    def encode_terms(self, colname='HPterms', csep=';'):
+
+        # encode each row's term list, of column data vector, into integer term ids
+        # (a column only held encoded, after load_data_chunked, is kept as is)
+        if self.data is not None and colname in self.data.columns:
+            self.terms[colname], self.vocab[colname] = similarity.encode_terms(self.data[colname], sep=csep)
+
+    def term_matrix(self, colname='HPterms'):
+
+        # binary patients x terms CSR matrix, encoding the column once if needed
+        if colname not in self.terms:
+            self.encode_terms(colname)
+
+        return similarity.term_matrix(self.terms[colname], n_terms=len(self.vocab[colname]))
+
+    def patientHPsim(self, engine=ENGINE, workers=WORKERS, storage=None, fname=SIMFILE):
+
+        # engine: 'sparse' (default) vectorized Jaccard on the patients x HP terms
+        #          CSR matrix, storing only the nonzero similarities in self.sim,
+        #         'loop' the original pairwise loop over a dense N x N matrix.
+        # workers: number of processes sharing the sparse engine's row blocks
+        #          (None for all cores).
+        # storage: layout of self.sim, 'dense' (N x N float64), 'packed' (float32
+        #          upper triangle), 'sparse' (upper triangle nonzeros, CSR) or
+        #          'memmap' (packed, on disk in dataDIR/fname). Defaults to the
+        #          engine's own, i.e. 'sparse' or 'dense'. Sparse storage holds
+        #          no zero similarities, so patientHPsim_edges and export_sim
+        #          then need a threshold > 0.
+        if engine == 'sparse':
+            self.patientHPsim_sparse(workers=workers, storage=storage or 'sparse', fname=fname)
+        elif engine == 'loop':
+            self.patientHPsim_loop(storage=storage or 'dense', fname=fname)
+        else:
+            raise ValueError("unknown similarity engine: %s" % engine)
+
+    def sim_file(self, fname=SIMFILE):
+        return os.path.join(self.dataDIR, fname)
+
+    def patientHPsim_sparse(self, workers=WORKERS, storage='sparse', fname=SIMFILE):
+
+        self.method = "HP_Jacard_Sim"
+
+        if self.data is not None:
+            self.N = len(self.data)
+
+            if self.N > 0:
+
+                X = self.term_matrix('HPterms')
+
+                # row blocks are written into the storage as they come
+                if workers == 1:
+                    blocks = similarity.jaccard_blocks(X)
+                else:
+                    blocks = similarity.parallel_jaccard_blocks(X, workers=workers)
+
+                self.sim = similarity.store_blocks(blocks, self.N, storage, self.sim_file(fname))
+
+    def patientHPsim_loop(self, storage='dense', fname=SIMFILE):
+
+        self.method = "HP_Jacard_Sim"
+
+        if self.data is not None:
+            self.N = len(self.data)
+
+            if self.N > 0:
+
+                self.sim = similarity.allocate(self.N, storage, self.sim_file(fname))
+
+            hpterms = self.term_column('HPterms')
 
             for i in range(self.N):
-                s1 = self.data['HPterms'][i]
+                s1 = hpterms[i]
                 #if not np.isnan(s1):
                 s1 = set(str.split(s1, ';'))
                 for j in range(self.N):
                     if j > i:
-                        s2 = self.data['HPterms'][j]
+                        s2 = hpterms[j]
                         #if not np.isnan(s2):
                         s2 = set(str.split(s2, ';'))
                         sint = s1.intersection(s2)
@@ -123,9 +280,52 @@ class patient(object):
                         self.sim[j, i] = val
                         # print(sim[i,j])
 
+            if self.N > 0:
+                self.sim = similarity.finalize(self.sim)
+
+
+    def patientHPsim_semantic(self, ont, measure='lin', storage='packed', fname=SIMFILE):
+
+        # ontology-aware similarity: best-match-average over the patients' HP
+        # terms of the Resnik or Lin term similarity, taken from the ancestor
+        # closure and information content of `ont` (an ontology_service.ontology,
+        # cached per ontology version). HP terms unknown to the ontology are
+        # ignored. Scoring is done on sparse/dense array operations, in patient
+        # blocks, into a packed upper triangle (or any other storage).
+        self.method = "HP_%s_BMA_Sim" % measure.capitalize()
+
+        if self.data is not None:
+            self.N = len(self.data)
+
+            if self.N > 0:
+
+                terms, closure, ic = ont.semantic_tables()
+                index = {t: i for i, t in enumerate(terms)}
+
+                # ontology terms used by the cohort, and the patients x used terms matrix
+                if 'HPterms' not in self.terms:
+                    self.encode_terms('HPterms')
+
+                vocab = self.vocab['HPterms']
+                known = np.array([index.get(t, -1) for t in vocab], dtype=np.int64)
+                used  = np.flatnonzero(known >= 0)
+                remap = np.full(len(vocab), -1, dtype=np.int64)
+                remap[used] = np.arange(len(used))
+
+                rows = [remap[r][remap[r] >= 0].astype(np.int32) for r in self.terms['HPterms']]
+                X    = similarity.term_matrix(rows, n_terms=len(used))
+
+                S   = similarity.term_similarity(closure, ic, known[used], measure)
+                sim = similarity.PackedUpper(self.N, filename=self.sim_file(fname) if storage == 'memmap' else None)
+
+                sim = similarity.bma_similarity(X, S, sim)
+
+                self.sim = similarity.convert(sim, 'packed' if storage == 'memmap' else storage)
 
     def patientHPsim_edges(self, threshold=THRES):
 
+        # works on any self.sim storage, reading its upper triangle row by row
+        # (or only the stored values of a sparse matrix)
         if self.sim is not None:
 
             dim = self.sim.shape
@@ -134,12 +334,168 @@ class patient(object):
 
                 self.ss = []
 
-            for i in range(dim[0]):
-                for j in range(dim[0]):
-                    if j > i:
-                        if self.sim[i, j] >= threshold:
-                            self.ss.append([i, j, round(self.sim[i, j], 3)])
+            for i, j, v in zip(*similarity.upper_edges(self.sim, threshold)):
+                self.ss.append([int(i), int(j), round(float(v), 3)])
+
+    def export_sim(self, fname=SIMCSV, threshold=THRES, fsep=','):
+
+        # write the upper triangle of self.sim, whatever its storage, as patient id pairs
+        if self.sim is not None:
+            rows, cols, vals = similarity.upper_edges(self.sim, threshold)
+            ids = np.asarray(self.data['id'])
+            df  = pd.DataFrame({'source': ids[rows], 'target': ids[cols], 'sim': vals})
+            df.to_csv(path_or_buf=os.path.join(self.dataDIR, fname), sep=fsep, header=True, index=False)
+
+    def patientHPsim_search(self, threshold=THRES, workers=WORKERS):
+
+        # threshold-aware alternative to patientHPsim + patientHPsim_edges:
+        # an HP term -> patients inverted index, with prefix/size filtering, only
+        # generates pairs able to reach the threshold, and never builds self.sim.
+        # With workers != 1 the rows are instead scored in blocks over a process
+        # pool, each worker returning only the pairs that pass the threshold.
+        self.method = "HP_Jacard_Sim"
+
+        if self.data is not None:
+            self.N = len(self.data)
+
+            if 'HPterms' not in self.terms:
+                self.encode_terms('HPterms')
+
+            if workers == 1:
+                edges = similarity.allpairs_jaccard(self.terms['HPterms'], threshold)
+            else:
+                edges = similarity.parallel_jaccard(self.term_matrix('HPterms'), threshold=threshold, workers=workers)
+
+            self.ss = []
+            for i, j, v in zip(*edges):
+                self.ss.append([int(i), int(j), round(v, 3)])
+
+    def patientHPsim_minhash(self, threshold=THRES, bands=BANDS, rows=ROWS, seed=0):
+
+        # approximate mode for very large cohorts: MinHash signatures over each
+        # patient's HP term set, LSH banding (bands x rows hashes) to generate
+        # candidate pairs, and exact Jaccard re-scoring of the candidates only.
+        # More bands, or fewer rows per band, trade speed for recall; the
+        # default 32 x 2 catches most pairs around THRES.
+        self.method = "HP_Jacard_Sim"
+
+        if self.data is not None:
+            self.N = len(self.data)
+
+            if self.N > 0:
+
+                edges = similarity.minhash_jaccard(self.term_matrix('HPterms'), threshold,
+                                                   bands=bands, rows=rows, seed=seed)
+
+                self.ss = []
+                for i, j, v in zip(*edges):
+                    self.ss.append([int(i), int(j), round(v, 3)])
+
+    def patientHPsim_knn(self, k=KNN):
+
+        # k-NN patient graph: rather than a global threshold, each patient keeps
+        # its k most similar neighbours, so hubs are capped and rare-phenotype
+        # patients still get edges. Picks each patient's k best from dense
+        # similarity row blocks, memory O(N k) besides the block.
+        self.method = "HP_Jacard_Sim"
+
+        if self.data is not None:
+            self.N = len(self.data)
+
+            if self.N > 0:
 
+                edges = similarity.knn_jaccard(self.term_matrix('HPterms'), k)
+
+                self.ss = []
+                for i, j, v in zip(*edges):
+                    self.ss.append([int(i), int(j), round(v, 3)])
+
+    def patientHPsim_incremental(self, fname=INDEX, threshold=THRES):
+
+        # incremental mode: the previous patient index (ids, HP terms) and edge
+        # set are kept on disk in dataDIR/fname. Only patients that are new, or
+        # whose HP terms changed, are scored against everyone else, and only the
+        # new or changed Shared_HP_terms edges are put in self.ss; edges that no
+        # longer pass, or whose patients were removed, are listed as id pairs in
+        # self.ss_removed, and the removed patients' ids in self.ids_removed.
+        # Without a previous index every patient is scored.
+        self.method      = "HP_Jacard_Sim"
+        self.ss          = []
+        self.ss_removed  = []
+        self.ids_removed = []
+
+        if self.data is None:
+            return
+
+        self.N = len(self.data)
+        X      = self.term_matrix('HPterms')
+        ids    = np.asarray(self.data['id']).astype(str)
+        vocab  = np.array(list(self.vocab['HPterms']), dtype=object)
+        cur    = [frozenset(vocab[r]) for r in self.terms['HPterms']]
+
+        index_file = os.path.join(self.dataDIR, fname)
+        prev       = None
+        if os.path.isfile(index_file):
+            # read into memory, as the file is rewritten below
+            with np.load(index_file, allow_pickle=False) as npz:
+                prev = {k: npz[k] for k in npz.files}
+
+        # patients to (re)score, and patients gone since the previous run
+        if prev is None:
+            delta   = np.arange(self.N)
+            removed = np.zeros(0, dtype=str)
+            keep    = np.zeros(0, dtype=bool)
+        else:
+            pvocab = prev['vocab']
+            pterms = {pid: frozenset(pvocab[prev['indices'][a:b]])
+                      for pid, a, b in zip(prev['ids'], prev['indptr'][:-1], prev['indptr'][1:])}
+            delta   = np.array([i for i in range(self.N) if pterms.get(ids[i]) != cur[i]], dtype=np.int64)
+            removed = np.setdiff1d(prev['ids'], ids)
+            touched = np.concatenate([ids[delta], removed])
+            keep    = ~(np.isin(prev['src'], touched) | np.isin(prev['dst'], touched))
+
+        # score the delta patients against every patient, a row block at a time
+        if prev is None:
+            parts = list(similarity.jaccard_blocks(X, threshold=threshold))
+        else:
+            parts = []
+            sizes = similarity.row_sizes(X)
+            for start in range(0, len(delta), similarity.BLOCK):
+                rows, cols, vals = similarity.jaccard_rows(X, delta[start:start + similarity.BLOCK], sizes)
+                mask = vals >= threshold
+                parts.append((np.minimum(rows, cols)[mask], np.maximum(rows, cols)[mask], vals[mask]))
+
+        lo, hi, vals = [np.concatenate(p) for p in zip(*parts)] if parts else [np.zeros(0, dtype=np.int64)] * 3
+        pairs, first = np.unique(lo * self.N + hi, return_index=True)
+        lo, hi, vals = pairs // self.N, pairs % self.N, vals[first]
+
+        # compare with the previous edges of the touched patients
+        old = {}
+        if prev is not None:
+            for u, v, w in zip(prev['src'][~keep], prev['dst'][~keep], prev['sim'][~keep]):
+                old[(min(u, v), max(u, v))] = round(float(w), 3)
+
+        new = set()
+        for i, j, v in zip(lo, hi, vals):
+            key = (min(ids[i], ids[j]), max(ids[i], ids[j]))
+            new.add(key)
+            if old.get(key) != round(float(v), 3):
+                self.ss.append([int(i), int(j), round(float(v), 3)])
+
+        self.ss_removed  = [[str(u), str(v)] for (u, v) in old if (u, v) not in new]
+        self.ids_removed = [str(u) for u in removed]
+
+        # save the updated index and edge set
+        src = ids[lo]
+        dst = ids[hi]
+        sim = vals
+        if prev is not None:
+            src = np.concatenate([prev['src'][keep], src])
+            dst = np.concatenate([prev['dst'][keep], dst])
+            sim = np.concatenate([prev['sim'][keep], sim])
+
+        np.savez(index_file, ids=ids, vocab=vocab.astype(str), indptr=X.indptr, indices=X.indices,
+                 src=src.astype(str), dst=dst.astype(str), sim=sim)
 
     def get_edges(self, edge_key_type=0):
 
@@ -150,15 +506,20 @@ class patient(object):
 
                 patient_rel = relationship.relationship()
 
-                edge_label = "Shared_HP_terms"
+                edge_label = EDGE
 
                 for i in range(len(self.ss)):
                     U  = self.ss[i][0]
                     V  = self.ss[i][1]
                     We = self.ss[i][2]
 
+                    # undirected: the subject is the lower patient id, whatever the row order
+                    if str(self.gg.node[V]['id']) < str(self.gg.node[U]['id']):
+                        U, V = V, U
+
                     patient_rel.__init__()
-                    patient_rel.create(objID='Pe:{}'.format(i),
+                    # the id is the (subject, object) pair, so it does not depend on the row order
+                    patient_rel.create(objID='Pe:{}:{}'.format(self.gg.node[U]['id'], self.gg.node[V]['id']),
                                        objLABEL=edge_label,
                                        soID=self.gg.node[U]['id'],
                                        siID=self.gg.node[V]['id'],
@@ -166,7 +527,7 @@ class patient(object):
                                        siLABEL=self.gg.node[V]['label'],
                                        dir="",
                                        we=str(We),# fix
-                                       meth="HP_Jacard_Sim",
+                                       meth=self.method,
                                        _type=edge_label,
                                        _pred=edge_label
                                        )
@@ -174,4 +535,43 @@ class patient(object):
                     self.gg.add_edge(u=U,v=V, attr_dict=patient_rel.att_map)
                     # self.gg.add_edge(U,V) #new code
                     # for ek, ev in patient_rel.att_map.items():
-                    #    self.gg[U][V][edge_key_type][ek] = ev
\ No newline at end of file
+                    #    self.gg[U][V][edge_key_type][ek] = ev
+
+    def get_edges_bulk(self):
+
+        # same edges as get_edges, but relationship.create runs once for a shared
+        # template, each edge only filling in its own ids, labels and weight, and
+        # they are inserted with add_edges_from
+        if (self.ss is not None) and (self.gg.number_of_nodes() > 0):
+
+            if len(self.ss) > 0:
+
+                edge_label = EDGE
+
+                patient_rel = relationship.relationship()
+                patient_rel.create(objLABEL=edge_label,
+                                   dir="",
+                                   meth=self.method,
+                                   _type=edge_label,
+                                   _pred=edge_label
+                                   )
+                template = patient_rel.att_map
+
+                nodes = self.gg.node
+                ids    = {n: str(utils.set_values(a['id']))    for n, a in nodes.items()}
+                labels = {n: str(utils.set_values(a['label'])) for n, a in nodes.items()}
+
+                def edge_maps():
+                    for U, V, We in self.ss:
+                        if ids[V] < ids[U]:
+                            U, V = V, U
+                        att_map = dict(template)
+                        att_map['id']            = 'Pe:{}:{}'.format(ids[U], ids[V])
+                        att_map['subject']       = ids[U]
+                        att_map['object']        = ids[V]
+                        att_map['subject_label'] = labels[U]
+                        att_map['object_label']  = labels[V]
+                        att_map['weight']        = str(We)
+                        yield U, V, att_map
+
+                self.gg.add_edges_from(edge_maps())
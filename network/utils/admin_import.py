@@ -0,0 +1,185 @@
+import csv, os, re
+
+# default --array-delimiter of neo4j-admin import
+ARRAY_DELIMITER = ';'
+
+# array delimiters to fall back on, if array values hold the default
+ARRAY_DELIMITERS = [ARRAY_DELIMITER, '|', '\x1f']
+
+# property keys that are encoded in the node/relationship header, not as properties
+NODE_IGNORE = ['category']
+EDGE_IGNORE = ['subject', 'predicate', 'object', 'subject_label', 'object_label']
+
+
+def value_type(value):
+    """
+    neo4j-admin import type of a (scalar) property value
+    """
+
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, int):
+        return 'long'
+    if isinstance(value, float):
+        return 'double'
+    return 'string'
+
+
+def merge_types(a, b):
+    """
+    Common type of two property types: long and double widen to double,
+    anything else mixed to string
+    """
+
+    if a == b:
+        return a
+    if set([a, b]) == set(['long', 'double']):
+        return 'double'
+    return 'string'
+
+
+def column_types(objs, ignore):
+    """
+    Collect the property columns of a stream of (key, attribute dict) pairs,
+    the key being the node category or edge predicate.
+
+    Returns a dict {key: {property: (type, is_array)}}, properties in order
+    of first appearance. A property that is a list/set/tuple anywhere is
+    written as an array, and one with values of several types as the common
+    type (see merge_types).
+    """
+
+    columns = {}
+    for key, obj in objs:
+        cols = columns.setdefault(key, {})
+        for prop, value in obj.items():
+            if prop in ignore or value is None:
+                continue
+
+            is_array = isinstance(value, (list, set, tuple))
+            if is_array:
+                vtype = None
+                for v in value:
+                    vtype = value_type(v) if vtype is None else merge_types(vtype, value_type(v))
+                if vtype is None:
+                    vtype = cols[prop][0] if prop in cols else 'string'
+            else:
+                vtype = value_type(value)
+
+            if prop in cols:
+                vtype    = merge_types(cols[prop][0], vtype)
+                is_array = is_array or cols[prop][1]
+            cols[prop] = (vtype, is_array)
+
+    return columns
+
+
+def header(columns, prefix=(), suffix=()):
+    """
+    Header row for the given property columns, e.g. ['id:ID', 'synonym:string[]', ':LABEL']
+    """
+
+    fields = list(prefix)
+    for key, (vtype, is_array) in columns.items():
+        fields.append('{}:{}{}'.format(key, vtype, '[]' if is_array else ''))
+    fields.extend(suffix)
+
+    return fields
+
+
+def array_delimiter(objs, ignore, delimiters=ARRAY_DELIMITERS):
+    """
+    First of delimiters found in no array element of a stream of (key,
+    attribute dict) pairs, so neo4j-admin does not split the elements
+    """
+
+    used = set()
+    for key, obj in objs:
+        for prop, value in obj.items():
+            if prop not in ignore and isinstance(value, (list, set, tuple)):
+                for v in value:
+                    used.update(d for d in delimiters if d in str(v))
+        if len(used) == len(delimiters):
+            break
+
+    for d in delimiters:
+        if d not in used:
+            return d
+
+    raise ValueError("array values hold every array delimiter: {}".format(delimiters))
+
+
+def format_value(value, is_array, delimiter=ARRAY_DELIMITER):
+    """
+    Format a property value as a CSV field: arrays are joined by the array
+    delimiter (an element holding it raises ValueError, see array_delimiter),
+    missing values are left empty (i.e. the property is not set)
+    """
+
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (list, set, tuple)):
+        items = [format_value(v, False, delimiter) for v in value]
+        if any(delimiter in v for v in items):
+            raise ValueError("array element holds the array delimiter '{}': {}".format(delimiter, value))
+        return delimiter.join(items)
+    if is_array:
+        return format_value([value], True, delimiter)
+
+    return str(value)
+
+
+def file_name(kind, key):
+    """
+    File-system safe CSV file name for a category or predicate
+    """
+
+    return '{}_{}.csv'.format(kind, re.sub(r'[^A-Za-z0-9_.-]+', '_', key))
+
+
+class Writers(object):
+    """
+    One csv.writer per category/predicate, opened (and headed) on first use
+    """
+
+    def __init__(self, directory, kind):
+        self.directory = directory
+        self.kind      = kind
+        self.files     = {}
+        self.writers   = {}
+
+    def get(self, key, fields):
+        if key not in self.writers:
+            filename = os.path.join(self.directory, file_name(self.kind, key))
+            self.files[key]   = open(filename, 'w', newline='')
+            self.writers[key] = csv.writer(self.files[key])
+            self.writers[key].writerow(fields)
+        return self.writers[key]
+
+    def filenames(self):
+        return {key: fh.name for key, fh in self.files.items()}
+
+    def close(self):
+        for fh in self.files.values():
+            fh.close()
+
+
+def command(node_files, edge_files, database='graph.db', delimiter=ARRAY_DELIMITER):
+    """
+    neo4j-admin import command line for the exported files
+    """
+
+    # non printable delimiters are given by code point, e.g. U+001F
+    if delimiter.isprintable():
+        delimiter = '"{}"'.format(delimiter)
+    else:
+        delimiter = 'U+{:04X}'.format(ord(delimiter))
+
+    args = ['neo4j-admin import', '--database={}'.format(database), '--id-type=STRING',
+            '--multiline-fields=true', '--array-delimiter={}'.format(delimiter)]
+    args += ['--nodes={}'.format(f) for f in node_files]
+    args += ['--relationships={}'.format(f) for f in edge_files]
+
+    return ' '.join(args)
@@ -0,0 +1,165 @@
+#--------------------------------------
+# Helpers to cut node/edge lists into batches for the graphical_db UNWIND loaders.
+#--------------------------------------
+
+import json
+from collections import Counter
+
+ROUNDS = 8
+SAMPLE = 20
+
+
+def conflict_free_rounds(edges, partitions, max_rounds=ROUNDS, subject='subject', object='object'):
+    """
+    Schedule edges for concurrent loading without lock conflicts.
+
+    A relationship MERGE locks both of its end nodes, so two transactions
+    touching a common node can block (or deadlock) each other. Each round
+    splits the pending edges into at most `partitions` groups whose endpoint
+    sets are pairwise disjoint: an edge joins the group already owning one
+    (or both) of its end nodes, or the smallest group if neither is owned yet.
+    Edges whose end nodes are owned by two different groups are deferred to
+    the next round. Edges at hub nodes are placed first, so hubs claim their
+    groups before the small edges fill up the rest.
+
+    Parameters
+    ----------
+    edges: list of dict
+    partitions: int, number of groups (i.e. concurrent sessions) per round
+    max_rounds: int, edges still conflicting after this many rounds are returned
+                as leftover, to be loaded serially
+
+    Returns
+    -------
+    rounds: list of rounds, each a list of non-empty edge groups
+    leftover: list of dict
+    """
+
+    degree  = Counter()
+    for e in edges:
+        degree[e[subject]] += 1
+        degree[e[object]]  += 1
+
+    pending = sorted(edges, key=lambda e: -max(degree[e[subject]], degree[e[object]]))
+    rounds  = []
+
+    while pending and len(rounds) < max_rounds:
+        owner    = {}
+        groups   = [[] for _ in range(partitions)]
+        deferred = []
+
+        for e in pending:
+            gs = owner.get(e[subject])
+            go = owner.get(e[object])
+
+            if gs is None and go is None:
+                g = min(range(partitions), key=lambda k: len(groups[k]))
+            elif gs is None or go is None or gs == go:
+                g = gs if gs is not None else go
+            else:
+                deferred.append(e)
+                continue
+
+            owner[e[subject]] = g
+            owner[e[object]]  = g
+            groups[g].append(e)
+
+        rounds.append([g for g in groups if g])
+        pending = deferred
+
+    return rounds, pending
+
+
+def payload_bytes(rows, sample=SAMPLE):
+    """
+    Estimated size of rows once serialized as query parameters, from the
+    JSON size of (up to) `sample` evenly spaced rows.
+    """
+
+    if len(rows) == 0:
+        return 0
+
+    step    = max(len(rows) // sample, 1)
+    sampled = rows[::step][:sample]
+
+    return int(len(json.dumps(sampled, default=str)) * len(rows) / len(sampled))
+
+
+class BatchSizer(object):
+    """
+    Adapts the UNWIND batch size to the measured cost of the previous batch.
+
+    After each batch the size is rescaled so a batch would take about
+    target_ms (growing or shrinking by at most a factor of 2 per step), then
+    capped so its payload stays below max_bytes, and kept within
+    [min_size, max_size]. Wide rows (e.g. ontology nodes with long synonym and
+    xref lists) thus get small batches, and thin rows (patient edges) large ones.
+    """
+
+    def __init__(self, size, min_size, max_size, target_ms, max_bytes):
+        self.min_size  = min_size
+        self.max_size  = max_size
+        self.target_ms = target_ms
+        self.max_bytes = max_bytes
+        self.size      = int(min(max(size, min_size), max_size))
+
+    def update(self, rows, elapsed_ms, payload):
+
+        if rows == 0:
+            return self.size
+
+        size = float(self.size)
+
+        if elapsed_ms > 0:
+            size = rows * self.target_ms / elapsed_ms
+            size = min(max(size, self.size / 2), self.size * 2)
+        else:
+            size = self.size * 2
+
+        if payload > 0:
+            size = min(size, self.max_bytes * rows / payload)
+
+        self.size = int(min(max(size, self.min_size), self.max_size))
+
+        return self.size
+
+
+def schema(objs, ignore=()):
+    """
+    Property names of a group of node/edge attribute dicts, in order of first
+    appearance, worked out once per group.
+    """
+
+    seen = {}
+    for obj in objs:
+        for key in obj:
+            if key not in seen and key not in ignore:
+                seen[key] = True
+
+    return list(seen)
+
+
+class Rows(object):
+    """
+    UNWIND parameter rows for a list of node/edge attribute dicts, built
+    lazily, one slice (i.e. batch) at a time.
+
+    Each row holds the `keys` properties present on the object; missing
+    properties are left out (so set to null, i.e. not set, by the query)
+    rather than filled in, and the source dicts are never modified.
+    """
+
+    def __init__(self, objs, keys):
+        self.objs = objs
+        self.keys = list(keys)
+
+    def __len__(self):
+        return len(self.objs)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.row(obj) for obj in self.objs[index]]
+        return self.row(self.objs[index])
+
+    def row(self, obj):
+        return {k: obj[k] for k in self.keys if k in obj}
@@ -0,0 +1,148 @@
+#--------------------------------------
+# Checkpoints of committed UNWIND batches, so an interrupted load can be
+# resumed, and retries of batches failing with transient errors.
+#--------------------------------------
+
+import hashlib, json, logging, os, random, threading, time
+
+from neo4j.v1 import TransientError, ServiceUnavailable, SessionExpired
+
+# errors worth retrying: deadlocks/lock timeouts, lost or unavailable servers
+TRANSIENT = (TransientError, ServiceUnavailable, SessionExpired)
+
+
+def retry(fn, retries=5, backoff=0.5, max_backoff=30.0, errors=TRANSIENT, on_retry=None):
+    """
+    Call fn(), retrying up to `retries` times on the given errors, sleeping
+    a random time up to backoff * 2^attempt (capped at max_backoff) between
+    attempts, i.e. exponential backoff with full jitter. on_retry(error) is
+    called before each retry.
+    """
+
+    attempt = 0
+    while True:
+        try:
+            return fn()
+        except errors as e:
+            if attempt >= retries:
+                raise
+            delay = random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+            attempt += 1
+            logging.warning("transient error ({}), retry {}/{} in {:.2f} s".format(e, attempt, retries, delay))
+            if on_retry is not None:
+                on_retry(e)
+            time.sleep(delay)
+
+
+def fingerprint(rows):
+    """
+    SHA-1 of the identities of a group's rows, in order: the id of each
+    node/edge dict (or its subject, predicate and object), or the row itself.
+    A batching.Rows is read from its source dicts, without building the rows.
+    """
+
+    h = hashlib.sha1()
+    for obj in getattr(rows, 'objs', rows):
+        if isinstance(obj, dict):
+            obj = obj['id'] if 'id' in obj else [obj.get('subject'), obj.get('predicate'), obj.get('object')]
+        h.update(json.dumps(obj, default=str).encode('utf-8'))
+        h.update(b'\n')
+
+    return h.hexdigest()
+
+
+class Checkpoint(object):
+    """
+    Committed row ranges of a load, per group key (e.g. 'nodes:HPO' or
+    'edges:IS_A:HPO:HPO'), kept in a JSON state file rewritten after every
+    commit. A restarted load skips what is recorded, resuming each group at
+    its first uncommitted row; this relies on the rows being produced in the
+    same order, as they are for the same graph.
+
+    Each key also records the row count and fingerprint of its rows (see
+    check), so ranges committed for other rows, i.e. another graph, are
+    discarded rather than skipped.
+    """
+
+    def __init__(self, fname):
+        self.fname  = fname
+        self.lock   = threading.Lock()
+        self.ranges = {}
+        self.rows   = {}
+
+        if os.path.exists(fname):
+            with open(fname, 'r') as fh:
+                for k, v in json.load(fh).items():
+                    if isinstance(v, list):
+                        # recorded without a fingerprint, so check discards it
+                        v = {'rows': None, 'fingerprint': None, 'ranges': v}
+                    self.ranges[k] = [tuple(r) for r in v['ranges']]
+                    self.rows[k]   = (v['rows'], v['fingerprint'])
+            logging.info("resuming load from checkpoint {}".format(fname))
+
+    def check(self, key, rows, fingerprint):
+        """
+        Tie key to `rows` rows with the given fingerprint, discarding its
+        committed ranges if they were recorded for other rows
+        """
+
+        with self.lock:
+            if self.ranges.get(key) and self.rows.get(key) != (rows, fingerprint):
+                logging.warning("checkpoint {} of {} was recorded for other rows, discarding it".format(key, self.fname))
+                del self.ranges[key]
+            self.rows[key] = (rows, fingerprint)
+
+    def resume(self, key, start):
+        """
+        First row at or after start that is not yet committed
+        """
+
+        with self.lock:
+            for lo, hi in self.ranges.get(key, []):
+                if lo <= start < hi:
+                    return hi
+            return start
+
+    def covered(self, key, start, stop):
+        """
+        Whether rows [start, stop) are all committed
+        """
+
+        return self.resume(key, start) >= stop
+
+    def commit(self, key, start, stop):
+        """
+        Record rows [start, stop) as committed
+        """
+
+        with self.lock:
+            ranges = sorted(self.ranges.get(key, []) + [(start, stop)])
+            merged = [ranges[0]]
+            for lo, hi in ranges[1:]:
+                if lo <= merged[-1][1]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+                else:
+                    merged.append((lo, hi))
+            self.ranges[key] = merged
+            self.save()
+
+    def save(self):
+        state = {}
+        for k, ranges in self.ranges.items():
+            rows, fp = self.rows.get(k, (None, None))
+            state[k] = {'rows': rows, 'fingerprint': fp, 'ranges': ranges}
+        tmp = self.fname + '.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(state, fh)
+        os.replace(tmp, self.fname)
+
+    def clear(self):
+        """
+        Drop the checkpoint, once the whole load is done
+        """
+
+        with self.lock:
+            self.ranges = {}
+            self.rows   = {}
+            if os.path.exists(self.fname):
+                os.remove(self.fname)
@@ -0,0 +1,121 @@
+#--------------------------------------
+# Process-wide registry of neo4j drivers (bolt connection pools) and http
+# clients, shared by all graphical_db instances connecting with the same
+# URI and credentials.
+#--------------------------------------
+
+import atexit, logging, threading
+import pkg_resources, yaml
+
+from neo4j.v1 import GraphDatabase as bolt_gdb
+from neo4jrestclient.client import GraphDatabase as http_gdb
+
+# bolt driver pool settings, read from the neo4j: pool: section of config.yml
+POOL_SETTINGS = ['max_connection_pool_size', 'max_connection_lifetime', 'connection_acquisition_timeout']
+
+_lock    = threading.Lock()
+_configs = {}
+_bolt    = {}
+_http    = {}
+
+
+def load_config(fname=None):
+    """
+    Read (once per process) the yml config, network/config.yml by default
+    """
+
+    if fname is None:
+        fname = pkg_resources.resource_filename('network', 'config.yml')
+
+    with _lock:
+        if fname not in _configs:
+            with open(fname, 'r') as ymlfile:
+                _configs[fname] = yaml.safe_load(ymlfile)
+        return _configs[fname]
+
+
+def pool_settings(cfg):
+    """
+    Driver pool settings given in a config
+    """
+
+    pool = cfg.get('neo4j', {}).get('pool') or {}
+    return {k: v for k, v in pool.items() if k in POOL_SETTINGS}
+
+
+def bolt_driver(uri, username, password, **settings):
+    """
+    Shared bolt driver for uri and credentials, created on first use with
+    `settings` (e.g. max_connection_pool_size, max_connection_lifetime,
+    connection_acquisition_timeout). Every call must be paired with a
+    release(driver).
+    """
+
+    key = (uri, username, password)
+    with _lock:
+        if key not in _bolt:
+            logging.debug("Initializing bolt driver with URI: {}".format(uri))
+            _bolt[key] = [bolt_gdb.driver(uri, auth=(username, password), **settings), 0]
+        elif settings:
+            logging.debug("reusing bolt driver for {}, ignoring settings {}".format(uri, settings))
+        _bolt[key][1] += 1
+        return _bolt[key][0]
+
+
+def http_driver(uri, username, password):
+    """
+    Shared http client for uri and credentials
+    """
+
+    key = (uri, username, password)
+    with _lock:
+        if key not in _http:
+            logging.debug("Initializing http driver with URI: {}".format(uri))
+            _http[key] = http_gdb(uri, username=username, password=password)
+        return _http[key]
+
+
+def release(driver, close=False):
+    """
+    Give back a bolt driver from bolt_driver. It stays open for later users
+    of the same URI, unless close is set and nobody else is using it.
+    """
+
+    with _lock:
+        for key, entry in list(_bolt.items()):
+            if entry[0] is driver:
+                entry[1] = max(entry[1] - 1, 0)
+                if close and entry[1] == 0:
+                    driver.close()
+                    del _bolt[key]
+                return
+
+
+def in_use(driver):
+    """
+    Number of unreleased acquisitions of a bolt driver
+    """
+
+    with _lock:
+        for entry in _bolt.values():
+            if entry[0] is driver:
+                return entry[1]
+        return 0
+
+
+def close_all():
+    """
+    Close all bolt drivers (at exit, or to drop every pooled connection)
+    """
+
+    with _lock:
+        for driver, count in _bolt.values():
+            try:
+                driver.close()
+            except Exception as e:
+                logging.warning("error closing driver: {}".format(e))
+        _bolt.clear()
+        _http.clear()
+
+
+atexit.register(close_all)
@@ -0,0 +1,162 @@
+#--------------------------------------
+# Load metrics of the graphical_db loaders: per node category / edge group
+# batch latency histograms, rows/s, payload bytes, retries and server
+# counters, exported as JSON or Prometheus text.
+#--------------------------------------
+
+import json, threading
+
+# batch latency histogram bucket upper bounds (ms)
+BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000]
+
+# server update counters recorded per group
+COUNTERS = ['nodes_created', 'nodes_deleted', 'relationships_created', 'relationships_deleted',
+            'properties_set', 'labels_added']
+
+PREFIX = 'sidb_load'
+
+
+class Histogram(object):
+    """
+    Fixed bucket histogram (counts per bucket, plus an overflow bucket)
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = list(buckets)
+        self.counts  = [0] * (len(self.buckets) + 1)
+        self.sum     = 0.0
+        self.count   = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum       += value
+        self.count     += 1
+
+    def cumulative(self):
+        """
+        [(upper bound, observations <= bound)], ending with ('+Inf', count)
+        """
+
+        total, res = 0, []
+        for bound, n in zip(self.buckets + ['+Inf'], self.counts):
+            total += n
+            res.append((bound, total))
+        return res
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the q-quantile
+        """
+
+        if self.count == 0:
+            return None
+        for bound, total in self.cumulative():
+            if total >= q * self.count:
+                return bound
+
+
+class LoadMetrics(object):
+    """
+    Metrics of a graphical_db load, per group: 'nodes:<labels>' or
+    'edges:<predicate>:<subject label>:<object label>' (thread safe)
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.lock    = threading.Lock()
+        self.groups  = {}
+
+    def _group(self, group):
+        if group not in self.groups:
+            self.groups[group] = {'batches': 0, 'rows': 0, 'ms': 0.0, 'bytes': 0, 'retries': 0,
+                                  'latency': Histogram(self.buckets),
+                                  'counters': dict.fromkeys(COUNTERS, 0)}
+        return self.groups[group]
+
+    def record(self, group, rows, ms, payload=0, summary=None):
+        """
+        Record one written batch: rows, latency (ms), payload bytes and the
+        counters of its result summary
+        """
+
+        with self.lock:
+            g = self._group(group)
+            g['batches'] += 1
+            g['rows']    += rows
+            g['ms']      += ms
+            g['bytes']   += payload
+            g['latency'].observe(ms)
+            if summary is not None:
+                for c in COUNTERS:
+                    g['counters'][c] += getattr(summary.counters, c, 0)
+
+    def retry(self, group):
+        with self.lock:
+            self._group(group)['retries'] += 1
+
+    def reset(self):
+        with self.lock:
+            self.groups = {}
+
+    def to_dict(self):
+        """
+        Metrics per group, with rows/s and the p50/p95/p99 batch latency
+        """
+
+        res = {}
+        with self.lock:
+            for group, g in self.groups.items():
+                h = g['latency']
+                res[group] = {'batches': g['batches'], 'rows': g['rows'], 'ms': g['ms'], 'bytes': g['bytes'],
+                              'retries': g['retries'],
+                              'rows_per_s': g['rows'] * 1000.0 / g['ms'] if g['ms'] > 0 else None,
+                              'latency_ms': {'p50': h.quantile(0.5), 'p95': h.quantile(0.95), 'p99': h.quantile(0.99),
+                                             'buckets': h.cumulative()},
+                              'counters': dict(g['counters'])}
+        return res
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self):
+        """
+        Prometheus text exposition of the metrics, labelled by kind (nodes or
+        edges) and group
+        """
+
+        def labels(group, **extra):
+            kind, _, name = group.partition(':')
+            pairs = [('kind', kind), ('group', name)] + sorted(extra.items())
+            return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                  for k, v in pairs) + '}'
+
+        lines = []
+        with self.lock:
+            groups = sorted(self.groups.items())
+
+            lines += ['# TYPE {}_batch_latency_ms histogram'.format(PREFIX)]
+            for group, g in groups:
+                for bound, total in g['latency'].cumulative():
+                    lines.append('{}_batch_latency_ms_bucket{} {}'.format(PREFIX, labels(group, le=bound), total))
+                lines.append('{}_batch_latency_ms_sum{} {}'.format(PREFIX, labels(group), g['latency'].sum))
+                lines.append('{}_batch_latency_ms_count{} {}'.format(PREFIX, labels(group), g['latency'].count))
+
+            for metric in ['batches', 'rows', 'bytes', 'retries']:
+                lines.append('# TYPE {}_{}_total counter'.format(PREFIX, metric))
+                for group, g in groups:
+                    lines.append('{}_{}_total{} {}'.format(PREFIX, metric, labels(group), g[metric]))
+
+            lines.append('# TYPE {}_rows_per_second gauge'.format(PREFIX))
+            for group, g in groups:
+                rate = g['rows'] * 1000.0 / g['ms'] if g['ms'] > 0 else 0
+                lines.append('{}_rows_per_second{} {}'.format(PREFIX, labels(group), rate))
+
+            lines.append('# TYPE {}_server_updates_total counter'.format(PREFIX))
+            for group, g in groups:
+                for c in COUNTERS:
+                    lines.append('{}_server_updates_total{} {}'.format(PREFIX, labels(group, counter=c), g['counters'][c]))
+
+        return '\n'.join(lines) + '\n'
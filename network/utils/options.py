@@ -0,0 +1,43 @@
+
+class LoadOptions(object):
+    """
+    Options for the graphical_db UNWIND loaders.
+
+     - batch_size: rows per UNWIND batch (the starting size when adaptive)
+     - explicit_tx: run each batch in an explicit write transaction, rather
+       than as an auto-commit session.run
+     - adaptive: resize batches from the measured latency and payload size of
+       the previous batch (see batching.BatchSizer), within
+       min_batch_size/max_batch_size, aiming at target_ms per batch and at most
+       max_payload_bytes of parameters
+     - fresh: the target database is empty (or freshly truncated), so nodes
+       and edges are written with CREATE rather than MERGE, after dropping
+       duplicates, and indexes are online before the edges are loaded. Loading
+       data already in the database this way duplicates it.
+     - retries, backoff, max_backoff: batches failing with a transient error
+       are retried up to `retries` times, with exponential backoff from
+       `backoff` seconds (at most max_backoff) and jitter
+     - checkpoint: state file recording the committed batches, so an
+       interrupted save_with_unwind resumes where it stopped. Not with fresh,
+       as the database a resumed load writes to is no longer empty.
+    """
+
+    def __init__(self, batch_size=1000, explicit_tx=False, adaptive=False,
+                 min_batch_size=100, max_batch_size=50000,
+                 target_ms=1000, max_payload_bytes=8 * 1024 * 1024, fresh=False,
+                 retries=5, backoff=0.5, max_backoff=30.0, checkpoint=None):
+        if fresh and checkpoint is not None:
+            raise ValueError("a fresh load can not be checkpointed, as resuming it is not into an empty database")
+
+        self.batch_size        = batch_size
+        self.explicit_tx       = explicit_tx
+        self.adaptive          = adaptive
+        self.min_batch_size    = min_batch_size
+        self.max_batch_size    = max_batch_size
+        self.target_ms         = target_ms
+        self.max_payload_bytes = max_payload_bytes
+        self.fresh             = fresh
+        self.retries           = retries
+        self.backoff           = backoff
+        self.max_backoff       = max_backoff
+        self.checkpoint        = checkpoint
@@ -0,0 +1,89 @@
+import hashlib, json, os
+
+from network.utils import utils
+
+# edge attributes that identify the edge, rather than being its content
+EDGE_KEYS = ['subject', 'predicate', 'object', 'subject_label', 'object_label']
+
+
+def content_hash(obj, ignore=()):
+    """
+    Stable hash of a node/edge attribute dict (independent of key order)
+    """
+
+    content = {k: v for k, v in obj.items() if k not in ignore}
+    data    = json.dumps(content, sort_keys=True, default=str)
+
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def edge_key(edge):
+    """
+    Identity of an edge: (subject, predicate, object)
+    """
+
+    return (edge['subject'], edge['predicate'], edge['object'])
+
+
+def graph_state(graph, edgesOnly=False):
+    """
+    Content state of a nx graph, as
+      nodes: {id: [labels, hash]}  (labels as in utils.label_key)
+      edges: {(subject, predicate, object): [subject_label, object_label, hash]}
+    (nodes is left empty with edgesOnly)
+    """
+
+    nodes = {}
+    if not edgesOnly:
+        for n in graph.nodes():
+            node = graph.node[n]
+            if 'id' in node:
+                nodes[node['id']] = [utils.label_key(node.get('category')), content_hash(node)]
+
+    edges = {}
+    for eso, esi, eattr in graph.edges(data=True):
+        edges[edge_key(eattr)] = [eattr.get('subject_label', ''), eattr.get('object_label', ''),
+                                  content_hash(eattr, EDGE_KEYS)]
+
+    return {'nodes': nodes, 'edges': edges}
+
+
+def load_state(fname):
+    """
+    Read the state of the previous load, empty if there is none
+    """
+
+    if fname is None or not os.path.exists(fname):
+        return {'nodes': {}, 'edges': {}}
+
+    with open(fname, 'r') as fh:
+        state = json.load(fh)
+
+    return {'nodes': state['nodes'],
+            'edges': {tuple(e[0]): e[1] for e in state['edges']}}
+
+
+def save_state(fname, state):
+    """
+    Write the state of a load (atomically, so a failed write keeps the old state)
+    """
+
+    tmp = fname + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump({'nodes': state['nodes'],
+                   'edges': [[list(k), v] for k, v in state['edges'].items()]}, fh)
+    os.replace(tmp, fname)
+
+
+def diff(old, new):
+    """
+    Keys of entries that were created, updated or deleted from old to new.
+    An entry whose labels changed (anything but the trailing hash) is
+    updated, so a relabelled node keeps its edges.
+    """
+
+    created = [k for k in new if k not in old]
+    deleted = [k for k in old if k not in new]
+    updated = [k for k in new if k in old and old[k] != new[k]]
+
+    return created, updated, deleted
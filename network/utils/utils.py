@@ -147,4 +147,26 @@ def append_values(key, values, _map, sep, dict_append=False):
                 values = str.split(values, sep)
             _map[key] = values
 
-    return(_map)
\ No newline at end of file
+    return(_map)
+
+def node_labels(category, sep=':'):
+
+    # normalised label set of a node category: 'A:B', ['A', 'B'] and
+    # ['B', 'A:B'] all give ['A', 'B'] (sorted, without the base label Node)
+    if category is None:
+        return []
+
+    stack, labels = [category], set()
+    while stack:
+        c = stack.pop()
+        if isinstance(c, (list, tuple, set)):
+            stack.extend(c)
+        else:
+            labels.update(l.strip() for l in str(c).split(sep))
+
+    return sorted(l for l in labels if l and l != 'Node')
+
+def label_key(category, sep=':'):
+
+    # the normalised labels joined as in cypher (n:A:B), Node if there are none
+    return sep.join(node_labels(category, sep)) or 'Node'
@@ -28,6 +28,7 @@ requires = [
     'click>=6.7',
     'pandas',
     'numpy',
+    'scipy',
     'networkx==1.11',
     'obonet',
     'ontobio',
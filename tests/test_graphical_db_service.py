@@ -77,3 +77,749 @@ class graphical_db(object):
   RETURN n.id AS ID, n.name AS NAME
   """
 
+
+
+class Counters(object):
+    def __init__(self, rows=0):
+        self.nodes_created = self.relationships_created = self.properties_set = self.labels_added = rows
+
+
+class Summary(object):
+    def __init__(self, rows=0, plan=None):
+        self.counters = Counters(rows)
+        self.plan     = plan
+
+
+class Result(list):
+    def __init__(self, records=(), rows=0, plan=None):
+        super(Result, self).__init__(records)
+        self.summary = Summary(rows, plan)
+
+    def consume(self):
+        return self.summary
+
+    def single(self):
+        return self[0] if self else None
+
+
+class Session(object):
+    """
+    Fake bolt session, recording the queries run on its Driver
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, query, **params):
+        with self.driver.lock:
+            self.driver.log.append(query)
+            self.driver.calls.append((query, dict(params)))
+        if query == "CALL db.constraints()":
+            return Result([{'description': d} for d in self.driver.constraints])
+        if query == "CALL db.indexes()":
+            return Result([{'description': d} for d in self.driver.indexes])
+        if query.startswith("EXPLAIN"):
+            return Result(plan=self.driver.plan(query))
+        rows = [v for v in params.values() if isinstance(v, list)]
+        return Result(rows=len(rows[0]) if rows else 0)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class Driver(object):
+    """
+    Fake bolt driver: `calls` holds every (query, parameters) run, `log`
+    just the queries
+    """
+
+    def __init__(self):
+        import threading
+        self.lock        = threading.Lock()
+        self.log         = []
+        self.calls       = []
+        self.constraints = ['CONSTRAINT ON ( hpo:HPO ) ASSERT hpo.id IS UNIQUE']
+        self.indexes     = ['INDEX ON :HPO(id)']
+        self.plan        = lambda query: None
+
+    def session(self):
+        return Session(self)
+
+    def rows(self, prefix, param):
+        """
+        Rows passed as `param` to the queries starting with prefix
+        """
+
+        return [row for query, params in self.calls if query.startswith(prefix) for row in params.get(param, [])]
+
+
+def test_conflict_free_rounds():
+    import random
+    from network.utils import batching
+
+    random.seed(1)
+    # a few hub nodes plus a long tail, as for patient -> HP term edges
+    edges = [{'subject': 'P%d' % random.randint(0, 300),
+              'object':  'HP:%d' % min(random.randint(0, 100), random.randint(0, 100))} for _ in range(2000)]
+
+    rounds, leftover = batching.conflict_free_rounds(edges, partitions=4, max_rounds=3)
+
+    scheduled = [e for groups in rounds for g in groups for e in g] + leftover
+    assert sorted(map(id, scheduled)) == sorted(map(id, edges))
+
+    for groups in rounds:
+        assert len(groups) <= 4
+        owners = {}
+        for k, g in enumerate(groups):
+            for e in g:
+                for n in (e['subject'], e['object']):
+                    assert owners.setdefault(n, k) == k
+
+
+def test_batch_sizer():
+    from network.utils import batching
+
+    sizer = batching.BatchSizer(1000, min_size=100, max_size=5000, target_ms=1000, max_bytes=10**6)
+
+    # fast batches grow at most 2x per step, up to max_size
+    assert sizer.update(1000, 100, 1000) == 2000
+    for _ in range(5):
+        sizer.update(sizer.size, 10, 1000)
+    assert sizer.size == 5000
+
+    # slow batches shrink towards target_ms
+    assert sizer.update(5000, 2000, 1000) == 2500
+
+    # payload cap: 2500 rows of 2000 bytes each -> at most 500 rows per MB
+    assert sizer.update(2500, 1000, 2500 * 2000) == 500
+
+    rows = [{'id': 'HP:%07d' % i, 'name': 'term %d' % i} for i in range(1000)]
+    assert abs(batching.payload_bytes(rows) - len(__import__('json').dumps(rows))) < 0.05 * len(__import__('json').dumps(rows))
+
+
+def test_export_admin_csv(tmp_path):
+    import csv
+    import networkx as nx
+    from network.graphical_db_service import graphical_db
+
+    g = nx.MultiDiGraph()
+    g.add_node('HP:1', {'id': 'HP:1', 'category': 'HPO', 'name': 'a, "b"', 'synonym': ['x', 'y'], 'ic': 1})
+    g.add_node('HP:2', {'id': 'HP:2', 'category': 'HPO', 'name': 'c', 'ic': 2.5})
+    g.add_node('P1', {'id': 'P1', 'category': 'Patient:Person', 'name': 'p'})
+    g.add_edge(u='P1', v='HP:1', attr_dict={'subject': 'P1', 'object': 'HP:1', 'predicate': 'HAS_PHENOTYPE',
+                                           'subject_label': 'Patient', 'object_label': 'HPO', 'weight': 0.5})
+
+    db = graphical_db(g, host='localhost', ports={})
+    node_files, edge_files, cmd = db.export_admin_csv(str(tmp_path))
+
+    assert len(node_files) == 2 and len(edge_files) == 1 and 'neo4j-admin import' in cmd
+
+    with open(str(tmp_path / 'nodes_HPO.csv')) as fh:
+        rows = list(csv.reader(fh))
+    assert rows[0] == ['id:ID', 'name:string', 'synonym:string[]', 'ic:double', ':LABEL']
+    assert rows[1] == ['HP:1', 'a, "b"', 'x;y', '1', 'Node;HPO']
+    assert rows[2] == ['HP:2', 'c', '', '2.5', 'Node;HPO']
+
+    with open(str(tmp_path / 'nodes_Patient_Person.csv')) as fh:
+        assert list(csv.reader(fh))[1][-1] == 'Node;Patient;Person'
+
+    with open(edge_files[0]) as fh:
+        rows = list(csv.reader(fh))
+    assert rows == [[':START_ID', ':END_ID', ':TYPE', 'weight:double'], ['P1', 'HP:1', 'HAS_PHENOTYPE', '0.5']]
+
+    # list elements holding ';' switch to another array delimiter
+    g.node['HP:2']['synonym'] = ['d;e', 'f']
+    node_files, edge_files, cmd = db.export_admin_csv(str(tmp_path / 'other'))
+    assert '--array-delimiter="|"' in cmd
+    with open(str(tmp_path / 'other' / 'nodes_HPO.csv')) as fh:
+        rows = list(csv.reader(fh))
+    assert rows[1][-1] == 'Node|HPO' and rows[2][2] == 'd;e|f'
+
+    from network.utils import admin_import
+    assert admin_import.array_delimiter([('HPO', {'s': ['a;b', 'c|d']})], []) == '\x1f'
+    assert '--array-delimiter=U+001F' in admin_import.command([], [], delimiter='\x1f')
+    try:
+        admin_import.format_value(['a;b'], True)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_sync_state(tmp_path):
+    import networkx as nx
+    from network.utils import sync_state
+
+    def graph(name, edges):
+        g = nx.MultiDiGraph()
+        g.add_node('HP:1', {'id': 'HP:1', 'category': 'HPO', 'name': name})
+        g.add_node('HP:2', {'id': 'HP:2', 'category': 'HPO', 'name': 'b'})
+        for s, o, w in edges:
+            g.add_edge(u=s, v=o, attr_dict={'subject': s, 'object': o, 'predicate': 'IS_A',
+                                            'subject_label': 'HPO', 'object_label': 'HPO', 'weight': w})
+        return g
+
+    fname = str(tmp_path / 'state.json')
+    assert sync_state.load_state(fname) == {'nodes': {}, 'edges': {}}
+
+    old = sync_state.graph_state(graph('a', [('HP:1', 'HP:2', 1), ('HP:2', 'HP:1', 1)]))
+    sync_state.save_state(fname, old)
+    old = sync_state.load_state(fname)
+
+    new = sync_state.graph_state(graph('a', [('HP:1', 'HP:2', 1), ('HP:2', 'HP:1', 1)]))
+    assert sync_state.diff(old['nodes'], new['nodes']) == ([], [], [])
+    assert sync_state.diff(old['edges'], new['edges']) == ([], [], [])
+
+    new = sync_state.graph_state(graph('c', [('HP:1', 'HP:2', 2)]))
+    assert sync_state.diff(old['nodes'], new['nodes']) == ([], ['HP:1'], [])
+    assert sync_state.diff(old['edges'], new['edges']) == ([], [('HP:1', 'IS_A', 'HP:2')], [('HP:2', 'IS_A', 'HP:1')])
+
+
+def test_save_as_jsonl(tmp_path):
+    import gzip, json
+    import networkx as nx
+    from network.graphical_db_service import graphical_db
+
+    g = nx.MultiDiGraph()
+    g.add_node('HP:1', {'id': 'HP:1', 'category': 'HPO', 'synonym': ['x', 'y']})
+    g.add_node('HP:2', {'id': 'HP:2', 'category': 'HPO'})
+    g.add_edge(u='HP:1', v='HP:2', attr_dict={'subject': 'HP:1', 'object': 'HP:2', 'predicate': 'IS_A'})
+
+    db = graphical_db(g, host='localhost', ports={})
+    nodes, edges = str(tmp_path / 'nodes.jsonl.gz'), str(tmp_path / 'edges.jsonl.gz')
+    db._save_as_jsonl(nodes, edges)
+
+    with gzip.open(nodes, 'rt') as fh:
+        assert sorted(json.loads(line)['id'] for line in fh) == ['HP:1', 'HP:2']
+    with gzip.open(edges, 'rt') as fh:
+        assert [json.loads(line) for line in fh] == [{'subject': 'HP:1', 'object': 'HP:2', 'predicate': 'IS_A'}]
+
+
+def test_save_via_apoc_stream(tmp_path):
+    import networkx as nx
+    from network.graphical_db_service import graphical_db
+
+    g = nx.MultiDiGraph()
+    g.add_node('HP:1', {'id': 'HP:1', 'category': 'HPO'})
+    g.add_node('P1', {'id': 'P1', 'category': 'Patient'})
+    g.add_edge(u='P1', v='HP:1', attr_dict={'id': 'e1', 'subject': 'P1', 'object': 'HP:1', 'predicate': 'HAS_A'})
+
+    db = graphical_db(g, host='localhost', ports={})
+    db.bolt_driver = Driver()
+    nodes, edges = str(tmp_path / 'nodes.jsonl.gz'), str(tmp_path / 'edges.jsonl.gz')
+    db.save_via_apoc_stream(nodes, edges, batch_size=500, parallel=False, retries=2)
+
+    # the missing Patient constraint is created before anything is loaded
+    apoc = [i for i, (query, params) in enumerate(db.bolt_driver.calls) if 'apoc.periodic.iterate' in query]
+    assert len(apoc) == 2
+    assert any('CREATE CONSTRAINT ON (n:Patient)' in q for q in db.bolt_driver.log[:apoc[0]])
+
+    (node_query, node_params), (edge_query, edge_params) = [db.bolt_driver.calls[i] for i in apoc]
+    assert 'CALL apoc.load.json($file, null, $config) YIELD value RETURN value' in node_query
+    assert node_params['file'] == 'file://' + nodes and edge_params['file'] == 'file://' + edges
+    assert node_params['config'] == {'compression': 'GZIP'}
+    assert (node_params['batch_size'], node_params['parallel'], node_params['retries']) == (500, False, 2)
+    assert node_params['statement'].startswith('MERGE (n:Node {id: value.id})')
+    assert 'apoc.merge.relationship(a, value.predicate, {id: value.id}, value, b)' in edge_params['statement']
+
+
+def test_node_labels():
+    from network.utils import utils
+
+    assert utils.node_labels('HPO') == ['HPO']
+    assert utils.node_labels('Patient:Person') == utils.node_labels(['Person', 'Patient:Node']) == ['Patient', 'Person']
+    assert utils.label_key(['Person', ['Patient']]) == 'Patient:Person'
+    assert utils.label_key(None) == utils.label_key([]) == 'Node'
+
+
+def test_driver_registry(tmp_path, monkeypatch):
+    from network.utils import drivers
+    from network.graphical_db_service import graphical_db
+
+    class FakeDriver(object):
+        def __init__(self, uri, auth=None, **settings):
+            self.uri, self.settings, self.closed = uri, settings, False
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(drivers.bolt_gdb, 'driver', FakeDriver)
+
+    with graphical_db(host='localhost', ports={'bolt': 7687}, username='u', password='p',
+                      max_connection_pool_size=10) as a:
+        b = graphical_db(host='localhost', ports={'bolt': 7687}, username='u', password='p')
+        driver = a.bolt_driver
+        assert b.bolt_driver is driver and driver.settings == {'max_connection_pool_size': 10}
+        assert drivers.in_use(driver) == 2
+        b.close()
+
+    assert a.bolt_driver is None and drivers.in_use(driver) == 0 and not driver.closed
+
+    c = graphical_db(host='localhost', ports={'bolt': 7687}, username='u', password='p')
+    assert c.bolt_driver is driver
+    c.close(close_driver=True)
+    assert driver.closed
+
+    fname = tmp_path / 'config.yml'
+    fname.write_text('neo4j:\n  host: localhost\n  pool:\n    max_connection_lifetime: 60\n    other: 1\n')
+    cfg = drivers.load_config(str(fname))
+    fname.write_text('neo4j: {}\n')
+    assert drivers.load_config(str(fname)) is cfg
+    assert drivers.pool_settings(cfg) == {'max_connection_lifetime': 60}
+
+
+def test_checkpoint(tmp_path):
+    from network.utils import checkpoint
+    from neo4j.v1 import TransientError
+
+    fname = str(tmp_path / 'load.ckpt')
+    ckpt = checkpoint.Checkpoint(fname)
+    ckpt.commit('nodes:HPO', 0, 1000)
+    ckpt.commit('nodes:HPO', 2000, 3000)
+    ckpt.commit('nodes:HPO', 1000, 1500)
+
+    ckpt = checkpoint.Checkpoint(fname)
+    assert ckpt.ranges['nodes:HPO'] == [(0, 1500), (2000, 3000)]
+    assert ckpt.resume('nodes:HPO', 0) == 1500 and ckpt.resume('nodes:HPO', 1700) == 1700
+    assert ckpt.covered('nodes:HPO', 2000, 2500) and not ckpt.covered('nodes:HPO', 1000, 2000)
+    assert ckpt.resume('edges:IS_A:HPO:HPO', 0) == 0
+
+    ckpt.clear()
+    assert not checkpoint.Checkpoint(fname).ranges
+
+    calls = []
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise TransientError('deadlock')
+        return 'done'
+
+    assert checkpoint.retry(flaky, retries=5, backoff=0.001) == 'done' and len(calls) == 3
+
+    calls.clear()
+    try:
+        checkpoint.retry(flaky, retries=1, backoff=0.001)
+        assert False
+    except TransientError:
+        assert len(calls) == 2
+
+
+def test_checkpoint_fingerprint(tmp_path):
+    from network.graphical_db_service import graphical_db
+    from network.utils import batching, checkpoint
+    from network.utils.options import LoadOptions
+
+    nodes = [{'id': 'HP:%d' % i, 'name': str(i)} for i in range(30)]
+    query = "UNWIND $nodes AS node MERGE (n:Node {id: node.id})"
+    fname = str(tmp_path / 'load.ckpt')
+
+    def interrupted(nodes):
+        # a load of nodes that stopped after its first batch
+        ckpt = checkpoint.Checkpoint(fname)
+        ckpt.check('nodes:HPO', len(nodes), checkpoint.fingerprint(nodes))
+        ckpt.commit('nodes:HPO', 0, 10)
+
+    def load(nodes):
+        db = graphical_db(host='localhost', ports={}, options=LoadOptions(batch_size=10, checkpoint=fname))
+        db.bolt_driver = Driver()
+        db.checkpoint  = checkpoint.Checkpoint(fname)
+        with db.bolt_driver.session() as session:
+            db.write_batches(session, query, batching.Rows(nodes, ['id', 'name']), 'nodes', 'nodes', group='nodes:HPO')
+        return [row['id'] for row in db.bolt_driver.rows('UNWIND $nodes', 'nodes')]
+
+    # the same rows resume after the committed batch
+    interrupted(nodes)
+    assert load(nodes) == [n['id'] for n in nodes[10:]]
+
+    # other rows under the same key (here, reordered) are all written again
+    interrupted(nodes)
+    assert load(nodes[::-1]) == [n['id'] for n in nodes[::-1]]
+
+    # the fingerprint only depends on the row identities
+    assert checkpoint.fingerprint(nodes) == checkpoint.fingerprint([{'id': n['id']} for n in nodes])
+    assert checkpoint.fingerprint(nodes) != checkpoint.fingerprint(nodes[:-1])
+
+    try:
+        LoadOptions(fresh=True, checkpoint=fname)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_load_metrics():
+    import json
+    from network.utils import metrics
+
+    class Counters(object):
+        nodes_created, properties_set = 100, 300
+
+    class Summary(object):
+        counters = Counters()
+
+    m = metrics.LoadMetrics(buckets=[10, 100, 1000])
+    for ms in [5, 50, 50, 500]:
+        m.record('nodes:HPO', 100, ms, payload=2000, summary=Summary())
+    m.record('edges:IS_A:HPO:HPO', 1000, 2000)
+    m.retry('edges:IS_A:HPO:HPO')
+
+    res = json.loads(m.to_json())
+    assert res['nodes:HPO']['rows'] == 400 and res['nodes:HPO']['bytes'] == 8000
+    assert res['nodes:HPO']['rows_per_s'] == 400 * 1000.0 / 605
+    assert res['nodes:HPO']['latency_ms']['p50'] == 100 and res['nodes:HPO']['latency_ms']['p99'] == 1000
+    assert res['nodes:HPO']['counters']['nodes_created'] == 400
+    assert res['edges:IS_A:HPO:HPO']['retries'] == 1 and res['edges:IS_A:HPO:HPO']['latency_ms']['p50'] == '+Inf'
+
+    text = m.to_prometheus()
+    assert 'sidb_load_batch_latency_ms_bucket{kind="nodes",group="HPO",le="100"} 3' in text
+    assert 'sidb_load_batch_latency_ms_count{kind="edges",group="IS_A:HPO:HPO"} 1' in text
+    assert 'sidb_load_retries_total{kind="edges",group="IS_A:HPO:HPO"} 1' in text
+    assert 'sidb_load_server_updates_total{kind="nodes",group="HPO",counter="properties_set"} 1200' in text
+
+
+def test_batch_rows():
+    from network.utils import batching
+
+    nodes = [{'id': 'HP:1', 'category': 'HPO', 'name': 'a'},
+             {'id': 'HP:2', 'category': 'HPO', 'synonym': ['b', 'c']}]
+
+    keys = ['id'] + batching.schema(nodes, ['category', 'id'])
+    assert keys == ['id', 'name', 'synonym']
+
+    rows = batching.Rows(nodes, keys)
+    assert len(rows) == 2
+    assert rows[0:2] == [{'id': 'HP:1', 'name': 'a'}, {'id': 'HP:2', 'synonym': ['b', 'c']}]
+    assert rows[1] == {'id': 'HP:2', 'synonym': ['b', 'c']}
+
+    # the source dicts are left as they were
+    assert nodes[0] == {'id': 'HP:1', 'category': 'HPO', 'name': 'a'} and 'name' not in nodes[1]
+
+
+def test_schema_manager():
+    from network.model.schema_manager import SchemaManager
+
+    driver = Driver()
+    driver.indexes += ['INDEX ON :Patient(name)', 'INDEX ON :Disease(id)']
+    schema = SchemaManager(driver)
+
+    assert schema.ensure(['HPO', 'Patient:Person', 'Disease']) == [('Patient', 'id'), ('Person', 'id'), ('Node', 'id')]
+    assert "CREATE CONSTRAINT ON (n:HPO) ASSERT n.id IS UNIQUE" not in driver.log
+    assert "CREATE CONSTRAINT ON (n:Disease) ASSERT n.id IS UNIQUE" not in driver.log
+    assert "CREATE INDEX ON :Node(id)" in driver.log and driver.log[-1].startswith("CALL db.awaitIndexes")
+
+    # nothing left to create, and the schema is not read again
+    del driver.log[:]
+    assert schema.ensure(['HPO', 'Patient']) == [] and driver.log == []
+
+    query = "UNWIND $edges AS edge MATCH (s:HPO {id: edge.subject}), (o:Gene {id: edge.object}) MERGE (s)-[r:IS_A]->(o)"
+    assert schema.unindexed(query) == [('Gene', 'id')]
+    assert schema.check(["UNWIND $nodes AS node MERGE (n:Node {id: node.id}) SET n:HPO"]) == {}
+
+
+def test_delete_edges():
+    from network.graphical_db_service import graphical_db
+
+    db = graphical_db(host='localhost', ports={})
+    db.bolt_driver = Driver()
+
+    stats = db.delete_edges([('P1', 'P2'), ('P3', 'P1')], 'Shared_HP_terms', 'Patient', 'Patient', directed=False)
+    assert stats['rows'] == 2
+
+    query, params = db.bolt_driver.calls[-1]
+    assert "MATCH (s:Patient {id: edge.subject})-[r:Shared_HP_terms]-(o:Patient {id: edge.object}) DELETE r" in query
+    assert params['edges'] == [{'subject': 'P1', 'object': 'P2'}, {'subject': 'P3', 'object': 'P1'}]
+
+    db.delete_edges([('HP:1', 'HP:2')], 'IS_A', 'HPO', 'HPO')
+    assert "-[r:IS_A]->(o:HPO" in db.bolt_driver.calls[-1][0]
+
+
+def test_delete_nodes():
+    from network.graphical_db_service import graphical_db
+
+    db = graphical_db(host='localhost', ports={})
+    db.bolt_driver = Driver()
+
+    stats = db.delete_nodes(['P1', 'P2'], 'Patient')
+    assert stats['rows'] == 2
+
+    query, params = db.bolt_driver.calls[-1]
+    assert query == "UNWIND $ids AS id MATCH (n:Patient {id: id}) DETACH DELETE n"
+    assert params['ids'] == ['P1', 'P2']
+
+
+def test_run_batch_explicit_tx():
+    from neo4j.v1 import TransientError
+    from network.graphical_db_service import graphical_db
+    from network.utils.options import LoadOptions
+
+    class Transaction(object):
+        """
+        Fake explicit transaction, closed as neo4j 1.7 does it: committed
+        by commit(), else rolled back when its block raises
+        """
+
+        def __init__(self, session):
+            self.session = session
+            self.success = None
+
+        def run(self, query, **params):
+            self.session.driver.events.append('run')
+            if self.session.driver.failures > 0:
+                self.session.driver.failures -= 1
+                raise TransientError('deadlock')
+            return self.session.run(query, **params)
+
+        def commit(self):
+            self.success = True
+            self.close()
+
+        def close(self):
+            if self.success is not None:
+                self.session.driver.events.append('commit' if self.success else 'rollback')
+                self.success = None
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, exc_type, *exc):
+            if self.success is None and exc_type is not None:
+                self.success = False
+            self.close()
+
+    class TxSession(Session):
+        def begin_transaction(self):
+            self.driver.events.append('begin')
+            return Transaction(self)
+
+    class TxDriver(Driver):
+        def session(self):
+            return TxSession(self)
+
+    db = graphical_db(host='localhost', ports={}, options=LoadOptions(explicit_tx=True, backoff=0.001))
+    db.bolt_driver = TxDriver()
+    db.bolt_driver.events, db.bolt_driver.failures = [], 1
+
+    # the failed write is rolled back, then retried in a new transaction
+    with db.bolt_driver.session() as session:
+        summary = db.run_batch(session, "UNWIND $nodes AS node MERGE (n:Node {id: node.id})",
+                               group='nodes:HPO', nodes=[{'id': 'HP:1'}, {'id': 'HP:2'}])
+
+    assert db.bolt_driver.events == ['begin', 'run', 'rollback', 'begin', 'run', 'commit']
+    assert summary.counters.nodes_created == 2
+    assert len(db.bolt_driver.calls) == 1
+    assert db.metrics.groups['nodes:HPO']['retries'] == 1
+
+
+def test_save_node_unwind_parallel():
+    from network.graphical_db_service import graphical_db
+    from network.utils.options import LoadOptions
+
+    nodes_by_category = {'HPO': [{'id': 'HP:%d' % i, 'category': 'HPO', 'name': str(i)} for i in range(95)],
+                         'Patient': [{'id': 'P%d' % i, 'category': 'Patient'} for i in range(23)]}
+
+    db = graphical_db(host='localhost', ports={}, options=LoadOptions(batch_size=10))
+    db.bolt_driver = Driver()
+    db.save_node_unwind_parallel(nodes_by_category, concurrency=4)
+
+    # every node is written once, in batches of at most batch_size
+    written = [row['id'] for row in db.bolt_driver.rows('UNWIND $nodes', 'nodes')]
+    assert sorted(written) == sorted(n['id'] for nodes in nodes_by_category.values() for n in nodes)
+    assert all(len(params['nodes']) <= 10 for query, params in db.bolt_driver.calls if 'nodes' in params)
+
+    # adaptive sizing applies to each partition: fast batches grow, up to max_batch_size
+    options = LoadOptions(batch_size=10, adaptive=True, min_batch_size=5, max_batch_size=40)
+    db = graphical_db(host='localhost', ports={}, options=options)
+    db.bolt_driver = Driver()
+    db.save_node_unwind_parallel(nodes_by_category, concurrency=2)
+
+    sizes = [len(params['nodes']) for query, params in db.bolt_driver.calls if 'nodes' in params]
+    assert sum(sizes) == 95 + 23
+    assert max(sizes) > 10 and max(sizes) <= 40
+
+
+def test_save_edge_unwind_parallel():
+    import random
+    from collections import Counter
+    from network.graphical_db_service import graphical_db
+    from network.utils.options import LoadOptions
+
+    # hub HP terms, so some edges are left over after the conflict-free rounds
+    random.seed(2)
+    edges_by_group = {}
+    for predicate in ['HAS_A', 'IS_A']:
+        key = (predicate, 'Patient', 'HPO')
+        pairs = set(('P%d' % random.randint(0, 60), 'HP:%d' % min(random.randint(0, 30), random.randint(0, 30)))
+                    for _ in range(400))
+        edges_by_group[key] = [{'subject': s, 'object': o, 'predicate': predicate,
+                                'subject_label': 'Patient', 'object_label': 'HPO'} for s, o in sorted(pairs)]
+
+    db = graphical_db(host='localhost', ports={}, options=LoadOptions(batch_size=16))
+    db.bolt_driver = Driver()
+    db.save_edge_unwind_parallel(edges_by_group, concurrency=4, max_rounds=2)
+
+    # every edge is written exactly once, by the query of its own group
+    written = Counter()
+    for query, params in db.bolt_driver.calls:
+        if query.startswith('UNWIND $edges'):
+            predicate = params['relationship']
+            assert '[r:%s]' % predicate in query
+            written.update((predicate, row['subject'], row['object']) for row in params['edges'])
+
+    expected = Counter((k[0], e['subject'], e['object']) for k, edges in edges_by_group.items() for e in edges)
+    assert written == expected and max(written.values()) == 1
+
+
+def test_load_unwind_async():
+    import asyncio, threading
+    import networkx as nx
+    from network.graphical_db_service import graphical_db
+    from network.utils.options import LoadOptions
+
+    g = nx.MultiDiGraph()
+    for i in range(50):
+        g.add_node('HP:%d' % i, {'id': 'HP:%d' % i, 'category': 'HPO', 'name': str(i)})
+    for i in range(1, 50):
+        g.add_edge(u='HP:%d' % i, v='HP:0', attr_dict={'subject': 'HP:%d' % i, 'object': 'HP:0', 'predicate': 'IS_A',
+                                                      'subject_label': 'HPO', 'object_label': 'HPO'})
+
+    db = graphical_db(g, host='localhost', ports={}, options=LoadOptions(batch_size=7))
+    db.bolt_driver = Driver()
+    db.save_with_unwind_async(concurrency=3, edge_concurrency=2)
+
+    nodes = db.bolt_driver.rows('UNWIND $nodes', 'nodes')
+    edges = db.bolt_driver.rows('UNWIND $edges', 'edges')
+    assert sorted(n['id'] for n in nodes) == sorted(g.nodes())
+    assert sorted(e['subject'] for e in edges) == sorted('HP:%d' % i for i in range(1, 50))
+
+    # with the writer stuck, the producer stops once the queue is full
+    gate, produced = threading.Event(), []
+
+    class Blocking(Session):
+        def run(self, query, **params):
+            gate.wait(5)
+            return super(Blocking, self).run(query, **params)
+
+    driver = Driver()
+    driver.session = lambda: Blocking(driver)
+    db = graphical_db(host='localhost', ports={}, options=LoadOptions(batch_size=1))
+    db.bolt_driver = driver
+
+    def objs():
+        for i in range(20):
+            produced.append(i)
+            yield 'HPO', {'id': 'HP:%d' % i}
+
+    async def load():
+        task = asyncio.ensure_future(db.pipeline(objs(), {'HPO': 'UNWIND $nodes AS node MERGE (n:Node {id: node.id})'},
+                                                 {'HPO': ['id']}, 'nodes', 1, queue_size=2))
+        await asyncio.sleep(0.2)
+        blocked = len(produced)
+        gate.set()
+        await task
+        return blocked
+
+    # one batch being written, two queued, and the producer waiting on the next
+    assert asyncio.run(load()) == 4
+    assert [n['id'] for n in driver.rows('UNWIND $nodes', 'nodes')] == ['HP:%d' % i for i in range(20)]
+
+
+def test_fresh_load():
+    import networkx as nx
+    from network.graphical_db_service import graphical_db
+    from network.utils.options import LoadOptions
+
+    g = nx.MultiDiGraph()
+    g.add_node('HP:1', {'id': 'HP:1', 'category': 'HPO'})
+    g.add_node('HP:2', {'id': 'HP:2', 'category': 'HPO'})
+    g.add_node('dup', {'id': 'HP:2', 'category': 'HPO'})
+    for _ in range(2):
+        g.add_edge(u='HP:2', v='HP:1', attr_dict={'subject': 'HP:2', 'object': 'HP:1', 'predicate': 'IS_A',
+                                                 'subject_label': 'HPO', 'object_label': 'HPO'})
+
+    for fresh, write in [(True, 'CREATE'), (False, 'MERGE')]:
+        db = graphical_db(g, host='localhost', ports={}, options=LoadOptions(fresh=fresh))
+        db.bolt_driver = Driver()
+        db.save_with_unwind()
+
+        queries = [q for q in db.bolt_driver.log if q.startswith('UNWIND')]
+        assert all(write in q for q in queries) and not any(('MERGE' if fresh else 'CREATE') in q for q in queries)
+
+        # CREATE would duplicate repeated nodes/edges, so they are dropped
+        nodes = sorted(n['id'] for n in db.bolt_driver.rows('UNWIND $nodes', 'nodes'))
+        edges = db.bolt_driver.rows('UNWIND $edges', 'edges')
+        assert nodes == (['HP:1', 'HP:2'] if fresh else ['HP:1', 'HP:2', 'HP:2'])
+        assert len(edges) == (1 if fresh else 2)
+
+
+def test_edge_groups(caplog):
+    import networkx as nx
+    from network.graphical_db_service import graphical_db
+
+    g = nx.MultiDiGraph()
+    for n, label in [('P1', 'Patient'), ('HP:1', 'HPO'), ('D1', 'Disease')]:
+        g.add_node(n, {'id': n, 'category': label})
+    for o, label in [('HP:1', 'HPO'), ('D1', 'Disease')]:
+        g.add_edge(u='P1', v=o, attr_dict={'subject': 'P1', 'object': o, 'predicate': 'HAS_A',
+                                          'subject_label': 'Patient', 'object_label': label})
+
+    class Op(object):
+        def __init__(self, operator_type, *children):
+            self.operator_type, self.children = operator_type, list(children)
+
+    # the Disease end has no index, so is matched by label scan
+    driver = Driver()
+    driver.plan = lambda q: Op('ProduceResults', Op('Merge', Op('NodeUniqueIndexSeek'),
+                                                    Op('NodeByLabelScan' if ':Disease' in q else 'NodeUniqueIndexSeek')))
+
+    db = graphical_db(g, host='localhost', ports={})
+    db.bolt_driver = driver
+    report = db.save_with_unwind()
+
+    # one MATCH per (subject label, object label) pair of the predicate
+    assert sorted(report) == [('HAS_A', 'Patient', 'Disease'), ('HAS_A', 'Patient', 'HPO')]
+    queries = [q for q in driver.log if q.startswith('UNWIND $edges')]
+    assert len(queries) == 2
+    assert any('MATCH (s:Patient {id: edge.subject}), (o:HPO {id: edge.object})' in q for q in queries)
+    assert any('MATCH (s:Patient {id: edge.subject}), (o:Disease {id: edge.object})' in q for q in queries)
+
+    for key in report:
+        assert report[key]['stats']['rows'] == 1 and report[key]['stats']['relationships_created'] == 1
+    assert report[('HAS_A', 'Patient', 'Disease')]['plan'] == ['ProduceResults', 'Merge', 'NodeUniqueIndexSeek', 'NodeByLabelScan']
+    assert "('HAS_A', 'Patient', 'Disease') are matched by label scan" in caplog.text
+    assert "('HAS_A', 'Patient', 'HPO') are matched by label scan" not in caplog.text
+
+
+def test_sync_relabel(tmp_path):
+    import networkx as nx
+    from network.graphical_db_service import graphical_db
+
+    g = nx.MultiDiGraph()
+    g.add_node('HP:0', {'id': 'HP:0', 'category': 'HPO', 'name': 'root'})
+    for i in range(1, 25):
+        g.add_node('HP:%d' % i, {'id': 'HP:%d' % i, 'category': 'HPO'})
+        g.add_edge(u='HP:%d' % i, v='HP:0', attr_dict={'subject': 'HP:%d' % i, 'object': 'HP:0', 'predicate': 'IS_A',
+                                                      'subject_label': 'HPO', 'object_label': 'HPO'})
+
+    fname = str(tmp_path / 'state.json')
+    db = graphical_db(g, host='localhost', ports={})
+    db.bolt_driver = Driver()
+    assert db.sync(fname)['edges']['created'] == 24
+
+    # a changed category relabels the node in place, keeping its edges
+    g.node['HP:0']['category'] = 'Phenotype'
+    db.bolt_driver = Driver()
+    report = db.sync(fname)
+    assert report == {'nodes': {'created': 0, 'updated': 1, 'deleted': 0},
+                      'edges': {'created': 0, 'updated': 0, 'deleted': 0}}
+
+    writes = [(q, p) for q, p in db.bolt_driver.calls if q.startswith('UNWIND')]
+    assert not any('DELETE' in q for q, p in writes)
+    assert writes == [("UNWIND $nodes AS node MERGE (n:Node {id: node.id}) REMOVE n:HPO SET n = node, n:Phenotype",
+                       {'nodes': [{'id': 'HP:0', 'name': 'root'}]})]
+
+    db.bolt_driver = Driver()
+    assert db.sync(fname)['nodes'] == {'created': 0, 'updated': 0, 'deleted': 0}
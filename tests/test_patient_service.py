@@ -24,8 +24,367 @@ def test_patient_service():
     assert pn.gg.number_of_edges()==288
 
 
+def test_patient_sparse_engine():
+
+    pn = patient()
+    pn.load_data()
+    pn.patientHPsim(engine='loop')
+    pn.patientHPsim_edges()
+    loop_ss = pn.ss
+
+    pn.patientHPsim(engine='sparse')
+    pn.patientHPsim_edges()
+
+    assert pn.ss == loop_ss
+
+    # zero similarities are not stored, so would silently be missing
+    try:
+        pn.patientHPsim_edges(threshold=0)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_patient_bulk_graph():
+
+    pn = patient()
+    pn.load_data()
+    pn.get_nodes()
+    pn.patientHPsim()
+    pn.patientHPsim_edges()
+    pn.get_edges()
+
+    bulk = patient()
+    bulk.load_data()
+    bulk.get_nodes_bulk()
+    bulk.ss = pn.ss
+    bulk.get_edges_bulk()
+
+    assert sorted(bulk.gg.nodes(data=True)) == sorted(pn.gg.nodes(data=True))
+    assert sorted(bulk.gg.edges(data=True)) == sorted(pn.gg.edges(data=True))
+
+
+def test_patient_chunked_loader():
+
+    pn = patient()
+    pn.load_data()
+    pn.patientHPsim()
+    pn.patientHPsim_edges()
+
+    chunked = patient()
+    chunked.load_data_chunked(chunksize=7)
+    assert list(chunked.data['id']) == list(pn.data['id'])
+
+    chunked.patientHPsim()
+    chunked.patientHPsim_edges()
+    assert chunked.ss == pn.ss
+
+    chunked.get_nodes_bulk()
+    for nid, att_map in chunked.gg.nodes(data=True):
+        assert set(att_map['GOterms'].split(';')) == set(pn.data['GOterms'][nid].split(';'))
+        assert att_map['HGNCIDs'] == str(pn.data['HGNCIDs'][nid])
+
+    # the loop engine and get_nodes work from the encoded terms
+    chunked.encode_terms('HPterms')
+    chunked.patientHPsim(engine='loop')
+    chunked.patientHPsim_edges()
+    assert chunked.ss == pn.ss
+
+    chunked.gg.clear()
+    chunked.get_nodes()
+    assert set(chunked.gg.node[0]) == set(pn.data.columns) | {'name', 'label', 'category'}
+
+
+def test_patient_sim_storage(tmp_path):
+
+    pn = patient()
+    pn.load_data()
+    pn.patientHPsim(engine='loop')
+    pn.patientHPsim_edges()
+    dense_ss = pn.ss
+
+    for engine in ['loop', 'sparse']:
+        for storage in ['dense', 'packed', 'sparse', 'memmap']:
+            pn.patientHPsim(engine=engine, storage=storage, fname=str(tmp_path / 'sim.dat'))
+            pn.patientHPsim_edges()
+            assert pn.ss == dense_ss
+
+    pn.export_sim(fname=str(tmp_path / 'sim.csv'), threshold=0.2)
+    assert len(open(str(tmp_path / 'sim.csv')).readlines()) == 288 + 1
+
+
+def test_patient_search():
+
+    pn = patient()
+    pn.load_data()
+    pn.patientHPsim(engine='loop')
+
+    for threshold in [0.1, 0.2, 0.5]:
+        pn.patientHPsim_edges(threshold=threshold)
+        loop_ss = pn.ss
+
+        pn.patientHPsim_search(threshold=threshold)
+        assert pn.ss == loop_ss
+
+
+def test_patient_parallel():
+
+    pn = patient()
+    pn.load_data()
+    pn.patientHPsim()
+    pn.patientHPsim_edges()
+    serial_ss = pn.ss
+
+    pn.patientHPsim(workers=2)
+    pn.patientHPsim_edges()
+    assert pn.ss == serial_ss
+
+    pn.patientHPsim_search(workers=2)
+    assert pn.ss == serial_ss
+
+
 def test_graph():
     from network.graphical_db_service import graphical_db
     gdb = graphical_db(graph=None)
 
 
+
+
+def test_patient_minhash():
+
+    pn = patient()
+    pn.load_data()
+    pn.patientHPsim()
+    pn.patientHPsim_edges()
+    exact_ss = pn.ss
+
+    # every approximate edge is exact, and with many 1-row bands none are missed
+    pn.patientHPsim_minhash()
+    assert all(e in exact_ss for e in pn.ss)
+
+    pn.patientHPsim_minhash(bands=64, rows=1)
+    assert pn.ss == exact_ss
+
+    pn.get_nodes()
+    pn.get_edges()
+    assert pn.gg.number_of_edges()==288
+
+
+def test_patient_knn():
+
+    pn = patient()
+    pn.load_data()
+    pn.patientHPsim(engine='loop')
+
+    k = 3
+    pn.patientHPsim_knn(k=k)
+
+    # every kept edge is among the k best of one of its end points
+    for i, j, v in pn.ss:
+        assert v == round(pn.sim[i, j], 3)
+        assert any((pn.sim[a] > pn.sim[a, b]).sum() < k for a, b in [(i, j), (j, i)])
+
+    # and no patient sharing an HP term with anyone is left without an edge
+    linked = set(e[0] for e in pn.ss) | set(e[1] for e in pn.ss)
+    assert linked == set(i for i in range(pn.N) if pn.sim[i].max() > 0)
+
+
+def test_patient_semantic():
+    import numpy as np
+    from network.utils import similarity
+
+    pn = patient()
+    pn.load_data()
+    pn.encode_terms('HPterms')
+
+    # toy HP ontology: root -> one group per last digit -> each patient HP term
+    hp_terms = [t for t in pn.vocab['HPterms'] if t != '']
+    groups   = sorted(set('G%s' % t[-1] for t in hp_terms))
+    terms    = ['HP:0000001'] + groups + hp_terms
+    edges    = [('HP:0000001', g) for g in groups] + [('G%s' % t[-1], t) for t in hp_terms]
+
+    class toy_ontology(object):
+        def semantic_tables(self):
+            closure = similarity.ancestor_closure(terms, edges)
+            return terms, closure, similarity.intrinsic_ic(closure)
+
+    pn.patientHPsim_semantic(toy_ontology(), measure='lin')
+    pn.patientHPsim_edges(threshold=0.5)
+    assert pn.method == 'HP_Lin_BMA_Sim'
+
+    # brute force best-match-average for the kept edges
+    terms_of = [set(pn.data['HPterms'][i].split(';')) - {''} for i in range(pn.N)]
+    ic = dict(zip(terms, toy_ontology().semantic_tables()[2]))
+
+    def lin(u, v):
+        if u == v:
+            return 1.0
+        mica = ic['G%s' % u[-1]] if u[-1] == v[-1] else 0.0
+        return 2 * mica / (ic[u] + ic[v])
+
+    for i, j, v in pn.ss[:50]:
+        P, Q = terms_of[i], terms_of[j]
+        bma = 0.5 * (np.mean([max(lin(p, q) for p in P) for q in Q]) +
+                     np.mean([max(lin(p, q) for q in Q) for p in P]))
+        assert abs(v - bma) < 1e-3
+
+
+def test_patient_incremental(tmp_path):
+
+    full = patient()
+    full.load_data()
+    full.patientHPsim()
+    full.patientHPsim_edges()
+    ids = list(full.data['id'])
+    full_edges = set((ids[i], ids[j]) for i, j, v in full.ss)
+
+    pn = patient()
+    pn.dataDIR = str(tmp_path)
+
+    # first run on the first 80 patients scores everyone
+    pn.data = full.data[:80].copy()
+    pn.terms, pn.vocab = {}, {}
+    pn.patientHPsim_incremental()
+    assert len(pn.ss) == len([e for e in full.ss if e[1] < 80])
+
+    # appending 20 patients only emits their edges
+    pn.data = full.data.copy()
+    pn.terms, pn.vocab = {}, {}
+    pn.patientHPsim_incremental()
+    assert pn.ss == [e for e in full.ss if e[1] >= 80]
+    assert pn.ss_removed == [] and pn.ids_removed == []
+
+    # re-running without changes emits nothing
+    pn.terms, pn.vocab = {}, {}
+    pn.patientHPsim_incremental()
+    assert pn.ss == []
+
+    # the index on disk holds the full edge set
+    import numpy as np
+    with np.load(str(tmp_path / 'patient_index.npz')) as index:
+        assert set(zip(index['src'], index['dst'])) == full_edges
+
+    # dropping a patient lists its edges for removal
+    pn.data = full.data[1:].reset_index(drop=True)
+    pn.terms, pn.vocab = {}, {}
+    pn.patientHPsim_incremental()
+    assert pn.ss == []
+    assert set(map(tuple, pn.ss_removed)) == set(tuple(sorted(e)) for e in full_edges if ids[0] in e)
+    assert pn.ids_removed == [str(ids[0])]
+
+    # edges run from the lower patient id, whatever the row order
+    pn.data = full.data[::-1].reset_index(drop=True)
+    pn.terms, pn.vocab = {}, {}
+    pn.patientHPsim_incremental(fname='reversed.npz')
+    pn.gg.clear()
+    pn.get_nodes_bulk()
+    pn.get_edges_bulk()
+    edges = [(a['subject'], a['object']) for u, v, a in pn.gg.edges(data=True)]
+    assert len(edges) == len(full_edges) and all(s < o for s, o in edges)
+
+
+def test_jaccard_blocks(tmp_path):
+    import numpy as np
+    from network.utils import similarity
+
+    pn = patient()
+    pn.load_data()
+    X = pn.term_matrix('HPterms')
+
+    # streamed blocks are the all-at-once pairs, and build the same matrix
+    blocks = list(similarity.jaccard_blocks(X, block=16))
+    assert len(blocks) == 7
+    for full, part in zip(similarity.jaccard_upper(X), zip(*blocks)):
+        assert np.array_equal(full, np.concatenate(part))
+
+    sim = similarity.store_blocks(iter(blocks), X.shape[0])
+    assert (sim != similarity.store(*similarity.jaccard_upper(X), X.shape[0])).nnz == 0
+
+    # every storage is filled block by block, including from the process pool
+    for storage in ['dense', 'packed', 'memmap']:
+        fname = str(tmp_path / 'sim.dat')
+        full  = similarity.store(*similarity.jaccard_upper(X), X.shape[0], storage, fname)
+        full  = np.array(full.data if storage != 'dense' else full)
+        for stream in [iter(blocks), similarity.parallel_jaccard_blocks(X, workers=2, block=16)]:
+            sim = similarity.store_blocks(stream, X.shape[0], storage, str(tmp_path / 'blocks.dat'))
+            assert np.array_equal(sim.data if storage != 'dense' else sim, full)
+
+    kept = np.concatenate([v for r, c, v in similarity.jaccard_blocks(X, block=16, threshold=0.2)])
+    assert len(kept) == 288 and kept.min() >= 0.2
+
+
+def test_allpairs_jaccard():
+    import numpy as np
+    from network.utils import similarity
+
+    # skewed term frequencies, with a few empty and duplicate sets
+    rng  = np.random.RandomState(0)
+    p    = 1.0 / np.arange(1, 61) ** 0.8
+    rows = [np.unique(rng.choice(60, rng.randint(1, 12), p=p / p.sum())).astype(np.int32) for _ in range(300)]
+    rows[5] = rows[17] = np.zeros(0, dtype=np.int32)
+    rows[40] = rows[41]
+    X = similarity.term_matrix(rows)
+
+    for threshold in [0.1, 0.3, 0.5, 0.8, 1.0]:
+        exact = [np.concatenate(a) for a in zip(*similarity.jaccard_blocks(X, block=64, threshold=threshold))]
+        found = similarity.allpairs_jaccard(rows, threshold, block=64)
+        for a, b in zip(exact, found):
+            assert np.array_equal(a, b)
+
+
+def test_parallel_without_shared_memory(monkeypatch):
+    import sys
+    import multiprocessing
+    import numpy as np
+    from network.utils import similarity
+
+    pn = patient()
+    pn.load_data()
+    X = pn.term_matrix('HPterms')
+    serial = similarity.jaccard_upper(X)
+
+    # as on python 3.7, where multiprocessing.shared_memory does not exist
+    monkeypatch.delattr(multiprocessing, 'shared_memory', raising=False)
+    monkeypatch.setitem(sys.modules, 'multiprocessing.shared_memory', None)
+
+    blocks, spec = similarity.share_matrix(X)
+    assert blocks == []
+
+    for a, b in zip(serial, similarity.parallel_jaccard(X, workers=2)):
+        assert np.array_equal(a, b)
+
+
+def test_knn_ties():
+    import numpy as np
+    from network.utils import similarity
+
+    # rows 0-4 are the same set, so each keeps the two lowest other indices
+    rows = [np.array([0])] * 5 + [np.array([5])]
+    X = similarity.term_matrix([np.asarray(r, dtype=np.int32) for r in rows])
+
+    for block in [1, 2, 2048]:
+        I, J, V = similarity.knn_jaccard(X, 2, block=block)
+        assert list(zip(I, J)) == [(0, 1), (0, 2), (0, 3), (0, 4), (1, 2), (1, 3), (1, 4)]
+
+
+def test_patient_graph_stable():
+    from network.utils import sync_state
+
+    def state(data):
+        pn = patient()
+        pn.data = data
+        pn.patientHPsim()
+        pn.patientHPsim_edges()
+        pn.get_nodes_bulk()
+        pn.get_edges_bulk()
+        return sync_state.graph_state(pn.gg)
+
+    full = patient()
+    full.load_data()
+    old = state(full.data.copy())
+
+    # dropping the first 20 patients shifts every row, but updates nothing
+    new = state(full.data[20:].reset_index(drop=True))
+    for kind in ['nodes', 'edges']:
+        created, updated, deleted = sync_state.diff(old[kind], new[kind])
+        assert created == [] and updated == [] and len(deleted) > 0